@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""Time `Runner.backup`, `Runner.restore` and `Runner.status` against the mock CDM.
+
+For every size, a source mock cluster holding that many objects is backed up,
+the backup is restored into an empty target mock cluster and the status of the
+restore jobs is queried. Prompts are answered automatically and the console
+output of the runs is discarded.
+
+    $ python benchmarks/bench_runner.py --sizes 10 1000 50000 --latency 0.01 --jitter 0.005
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import cli_ui
+
+from mock_cdm import MockCDMServer, MockCluster
+from rubrik_config.runner import Runner
+
+
+DEFAULT_SIZES = (10, 1000, 50000)
+
+
+@contextlib.contextmanager
+def non_interactive(quiet=True):
+    """Answer every prompt of rbkcb and optionally silence its console output."""
+    patched = {
+        'ask_choice': lambda *args, choices, **kwargs: choices[-1],
+        'ask_string': lambda *args, **kwargs: 'benchmark',
+        'ask_password': lambda *args, **kwargs: 'benchmark',
+        'read_input': lambda *args, **kwargs: ''
+    }
+    if quiet:
+        # The messages and tables are still formatted, only writing them is skipped
+        patched['write_and_flush'] = lambda *args, **kwargs: None
+
+    originals = { name: getattr(cli_ui, name) for name in patched }
+    for name, fn in patched.items():
+        setattr(cli_ui, name, fn)
+
+    try:
+        yield
+    finally:
+        for name, fn in originals.items():
+            setattr(cli_ui, name, fn)
+
+
+def run(size, workdir, args):
+    """Benchmark one size and return the timings of its phases."""
+    def make_cluster(objects):
+        return MockCluster(objects, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                           error_status=args.error_status, seed=args.seed)
+
+    def make_runner(server):
+        runner = Runner(os.path.join(workdir, 'backups'), workers=args.workers, page_size=args.page_size,
+                        snapshot_format=args.format, rate_limit=args.rate_limit)
+        runner._connect({ 'address': server.address, 'api_token': 'benchmark' })
+        return runner
+
+    results = []
+    def timed(phase, runner, cluster, fn):
+        requests = cluster.requests
+        started = time.monotonic()
+        fn()
+        elapsed = time.monotonic() - started
+
+        results.append({
+            'objects': size,
+            'phase': phase,
+            'seconds': round(elapsed, 3),
+            'objectsPerSecond': round(size / elapsed, 1) if elapsed else None,
+            'requests': cluster.requests - requests,
+            'bytes': runner.recorder.summary()['totalBytes']
+        })
+
+    source, target = make_cluster(size), make_cluster(0)
+    with MockCDMServer(source) as source_server, MockCDMServer(target) as target_server, non_interactive(not args.verbose):
+        runner = make_runner(source_server)
+        timed('backup', runner, source, runner.backup)
+
+        runner = make_runner(target_server)
+        timed('restore', runner, target, runner.restore)
+
+        runner = make_runner(target_server)
+        timed('status', runner, target, runner.status)
+
+    return results
+
+
+def print_results(results):
+    print('{:>8}  {:<8}  {:>9}  {:>10}  {:>9}  {:>12}'.format('Objects', 'Phase', 'Seconds', 'Objects/s', 'Requests', 'Bytes'))
+    for r in results:
+        print('{:>8}  {:<8}  {:>9.3f}  {:>10}  {:>9}  {:>12}'.format(
+            r['objects'], r['phase'], r['seconds'], r['objectsPerSecond'], r['requests'], r['bytes']))
+
+
+if '__main__' == __name__:
+    parser = argparse.ArgumentParser(description="Benchmark rbkcb against a mock CDM")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Numbers of objects to benchmark")
+    parser.add_argument('--workers', type=int, default=8, help="Number of concurrent workers of the runner")
+    parser.add_argument('--rate-limit', type=float, default=100, help="Maximum API requests per second of the runner")
+    parser.add_argument('--page-size', type=int, default=500, help="Number of objects per page of the listings")
+    parser.add_argument('--format', choices=['directory', 'cas', 'archive'], default='directory', help="Snapshot format of the backups")
+    parser.add_argument('--latency', type=float, default=0, help="Delay of every mock request in seconds")
+    parser.add_argument('--jitter', type=float, default=0, help="Maximum random deviation from the latency in seconds")
+    parser.add_argument('--error-rate', type=float, default=0, help="Share of the mock requests that fail")
+    parser.add_argument('--error-status', type=int, default=503, help="HTTP status of the failed mock requests")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the jitter and error injection")
+    parser.add_argument('--output', help="Also write the results as JSON to this file")
+    parser.add_argument('--verbose', action='store_true', help="Show the console output of the runs")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory(prefix='rbkcb-bench-') as workdir:
+            cwd = os.getcwd()
+            # The restore log and journal are written to the working directory
+            os.chdir(workdir)
+            try:
+                results += run(size, workdir, args)
+            finally:
+                os.chdir(cwd)
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(results, indent=4))
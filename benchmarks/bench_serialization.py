@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Time the serialization of snapshot items with every available JSON backend.
+
+The items are shaped like the ones of a backup of the mock CDM. For every
+backend, the items are serialized to their canonical and pretty forms and
+parsed back, then written to and read from a directory snapshot. The
+`legacy` rows time what items were written and read with before the
+serialization module, indented by four spaces with the standard library.
+
+    $ python benchmarks/bench_serialization.py --items 50000
+"""
+
+import argparse
+import importlib
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from mock_cdm import COLLECTIONS, _sample
+from rubrik_config import serialization, snapshot
+
+
+def make_items(count):
+    return [{
+        'clusterName': 'mock-cluster',
+        'clusterVersion': '5.3.0-p1-1234',
+        'type': COLLECTIONS[i % len(COLLECTIONS)].strip('/').replace('/', '_'),
+        'config': _sample(COLLECTIONS[i % len(COLLECTIONS)], i)
+    } for i in range(count)]
+
+
+def timed(fn):
+    started = time.monotonic()
+    result = fn()
+    return time.monotonic() - started, result
+
+
+def bench_legacy(items):
+    results = {}
+    results['pretty'], data = timed(lambda: [json.dumps(i, indent=4, sort_keys=True).encode('utf-8') for i in items])
+    results['parse'], _ = timed(lambda: [json.loads(d.decode('utf-8')) for d in data])
+    results['bytes'] = sum(len(d) for d in data)
+
+    return results
+
+
+def bench_backend(backend, items):
+    # The backend is chosen when the module is imported
+    os.environ['RBKCB_JSON_BACKEND'] = backend
+    importlib.reload(serialization)
+    importlib.reload(snapshot)
+
+    results = {}
+    results['canonical'], data = timed(lambda: [serialization.canonical_json(i) for i in items])
+    results['pretty'], pretty = timed(lambda: [serialization.dumps(i, pretty=True) for i in items])
+    results['parse'], _ = timed(lambda: [serialization.loads(d) for d in data])
+    results['bytes'] = sum(len(d) for d in pretty)
+    results['compactBytes'] = sum(len(d) for d in data)
+
+    with tempfile.TemporaryDirectory(prefix='rbkcb-bench-') as path:
+        writer = snapshot.DirectorySnapshotWriter(path)
+        results['write'], _ = timed(lambda: [writer.write(i['type'], f"item-{n:06d}", f"Item {n}", i)
+                                             for n, i in enumerate(items)])
+        writer.close()
+
+        reader = snapshot.open_snapshot(path)
+        results['read'], _ = timed(lambda: [list(reader.items(c)) for c in reader.config_types()])
+
+    return results
+
+
+def print_results(count, results):
+    print('{:>8}  {:<8}  {:>9}  {:>9}  {:>9}  {:>9}  {:>9}  {:>12}'.format(
+        'Items', 'Backend', 'Canonical', 'Pretty', 'Parse', 'Write', 'Read', 'Pretty bytes'))
+
+    def seconds(r, key):
+        return '{:.3f}'.format(r[key]) if key in r else '-'
+
+    for backend, r in results.items():
+        print('{:>8}  {:<8}  {:>9}  {:>9}  {:>9}  {:>9}  {:>9}  {:>12}'.format(
+            count, backend, seconds(r, 'canonical'), seconds(r, 'pretty'), seconds(r, 'parse'),
+            seconds(r, 'write'), seconds(r, 'read'), r['bytes']))
+
+
+if '__main__' == __name__:
+    parser = argparse.ArgumentParser(description="Benchmark the JSON serialization of snapshot items")
+    parser.add_argument('--items', type=int, default=50000, help="Number of items")
+    parser.add_argument('--output', help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    items = make_items(args.items)
+
+    results = { 'legacy': bench_legacy(items) }
+    for backend in ('json', 'orjson'):
+        if 'orjson' == backend and not importlib.util.find_spec('orjson'):
+            continue
+        results[backend] = bench_backend(backend, items)
+
+    print_results(args.items, results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps(results, indent=4))
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Time the start of `rbkcb` commands, each run in a new Python process.
+
+`status` runs against the mock CDM, with a restore log of one job per
+config type, so it measures what monitoring pays for every poll.
+
+    $ python benchmarks/bench_startup.py --runs 20
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from mock_cdm import MockCDMServer, MockCluster
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SCRIPT = os.path.join(ROOT, 'scripts', 'rbkcb')
+
+
+def restore_log(address):
+    jobs = [
+        { 'id': 'job-1', 'type': 'CREATE_SLA_DOMAIN', 'name': 'gold', 'createdOn': '2020-01-01T00:00:00',
+          'configType': 'sla_domain' },
+        { 'id': 'job-2', 'type': 'CREATE_FILESET_TEMPLATE', 'name': 'linux', 'createdOn': '2020-01-01T00:00:00',
+          'configType': 'fileset_template' }
+    ]
+
+    return {
+        'backupId': 'benchmark',
+        'createdOn': '2020-01-01T00:00:00',
+        'cluster': { 'name': 'mock-cluster', 'ip': address, 'version': '5.3.0' },
+        'jobs': jobs
+    }
+
+
+def time_command(argv, workdir, runs, stdin=None):
+    env = dict(os.environ, PYTHONPATH=os.path.join(ROOT, 'src'))
+
+    durations = []
+    for _ in range(runs):
+        started = time.monotonic()
+        subprocess.run(argv, cwd=workdir, env=env, input=stdin,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        durations.append(time.monotonic() - started)
+
+    return durations
+
+
+if '__main__' == __name__:
+    parser = argparse.ArgumentParser(description="Benchmark the startup of rbkcb commands")
+    parser.add_argument('--runs', type=int, default=10, help="Number of runs of every command")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='rbkcb-startup-') as workdir, MockCDMServer(MockCluster(0)) as server:
+        with open(os.path.join(workdir, '.restore_log'), 'w') as f:
+            f.write(json.dumps(restore_log(server.address)))
+
+        rbkcb = [sys.executable, SCRIPT]
+        commands = {
+            # The interpreter alone, the floor of every command
+            'python': [sys.executable, '-c', 'pass'],
+            '--help': rbkcb + ['--help'],
+            'list': rbkcb + ['list', os.path.join(workdir, 'backups')],
+            'status': rbkcb + ['status', os.path.join(workdir, 'backups')]
+        }
+
+        print('{:<10}  {:>10}  {:>10}  {:>10}'.format('Command', 'Median', 'Min', 'Max'))
+        for name, argv in commands.items():
+            # status asks for the API token of the cluster
+            durations = time_command(argv, workdir, args.runs, stdin=b'benchmark-token\n')
+
+            print('{:<10}  {:>9.1f}ms  {:>9.1f}ms  {:>9.1f}ms'.format(
+                name, 1000 * statistics.median(durations), 1000 * min(durations), 1000 * max(durations)))
@@ -24,10 +24,14 @@ setuptools.setup(
     python_requires='>=3.6',
     install_requires=[
         'cli-ui == 0.10.2',
-        'rubrik-cdm >= 2.0.8',
+        'PyYAML',
+        'requests',
         'toposort == 1.5',
     ],
     extras_require={
+        'fast': [
+            'orjson',
+        ],
         'docs': [
             'Sphinx == 3.1.2',
             'recommonmark == 0.6.0',
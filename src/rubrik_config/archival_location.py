@@ -3,57 +3,48 @@ import json
 import os
 import sys
 
-import cli_ui
-import rubrik_cdm
-
-from urllib.parse import urlencode
 from rubrik_config.rubrik_config_base import RubrikConfigBase
+from rubrik_config.secret_store import SecretField
+from rubrik_config.transport import TransportError
+
+from rubrik_config.helpers import config_name
+
+
+AZURE_SECRETS = [
+    SecretField('secretKey', 'Access Key', hidden=True),
+    SecretField('pemFileContent', 'RSA Key', optional=True, multiline=True)
+]
 
-from rubrik_config.helpers import config_name, ask_multiline_string
+# Encryption is only disabled when the password is explicitly given as blank
+NFS_SECRETS = [
+    SecretField('encryptionPassword', 'Encryption Password (leave blank to disable)', hidden=True)
+]
 
 
 class ArchivalLocationConfig(RubrikConfigBase):
 
-    def __init__(self, path, rubrik, logger):
-        super().__init__(path, rubrik, logger)
+    has_secrets = True
+
+    def __init__(self, path, rubrik, logger, **kwargs):
+        super().__init__(path, rubrik, logger, **kwargs)
 
 
     def backup(self):
-        object_store_locations_response = self._get_object_store_locations()
-        nfs_locations_response = self._get_nfs_locations()
+        object_store_total, object_store_locations = self._get_object_store_locations()
+        nfs_total, nfs_locations = self._get_nfs_locations()
         
-        total_locations = object_store_locations_response['total'] + nfs_locations_response['total']
+        total_locations = object_store_total + nfs_total
 
         self.logger.info("%s Archival locations found!" % total_locations)
 
-        self._write(object_store_locations_response['data'], self.config_name+'.object_store', lambda x: x['definition']['name'])
-        self._write(nfs_locations_response['data'], self.config_name+'.nfs', lambda x: x['definition']['name'])
+        saved = self._write(object_store_locations, self.config_name+'.object_store', lambda x: x['definition']['name'])
+        saved += self._write(nfs_locations, self.config_name+'.nfs', lambda x: x['definition']['name'])
 
-        return total_locations
+        return saved
 
 
     def restore(self, items):
-        jobs = []
-
-        for item in items:
-            try:
-                item_type = item['type'].split('.')[1]
-                
-                self.logger.info("Restoring archival location `{}`".format(item['config']['definition']['name']))
-
-                if 'object_store' == item_type:
-                    jobs += (self._add_object_store_location(item['config']), )
-                elif 'nfs' == item_type:
-                    jobs += (self._add_nfs_location(item['config']), )
-                elif 'qstar' == item_type:
-                    jobs += (self._add_qstar_location(item['config']), )
-                else:
-                    self.logger.error("Unrecognized archival location type '{}'".format(item_type))
-
-            except rubrik_cdm.exceptions.APICallException as e:
-                self.logger.error(e)
-
-        return jobs
+        return self._restore_items(items, self._restore_item)
 
 
     def status(self, job):
@@ -76,14 +67,64 @@ class ArchivalLocationConfig(RubrikConfigBase):
         return job_status
 
 
+    def secret_request(self, item):
+        definition = item['config']['definition']
+
+        if 'object_store' == item['type'].split('.')[1] and 'Azure' == definition.get('objectStoreType'):
+            fields = AZURE_SECRETS
+        elif 'nfs' == item['type'].split('.')[1]:
+            fields = NFS_SECRETS
+        else:
+            return None
+
+        try:
+            action, _ = self._plan(definition['name'], definition, updatable=False)
+            if 'skip' == action:
+                return None
+
+        except TransportError:
+            # Reported again when the item is restored
+            return None
+
+        return 'archival_location/{}'.format(definition['name']), fields
+
+
     # Private methods
 
+    def _restore_item(self, item):
+        item_type = item['type'].split('.')[1]
+
+        # Secrets can't be compared, so locations that differ are only reported
+        action, _ = self._plan(item['config']['definition']['name'], item['config']['definition'], updatable=False)
+        if 'skip' == action:
+            return None
+
+        if 'object_store' == item_type:
+            return self._add_object_store_location(item['config'])
+        elif 'nfs' == item_type:
+            return self._add_nfs_location(item['config'])
+        elif 'qstar' == item_type:
+            return self._add_qstar_location(item['config'])
+        else:
+            self.logger.error("Unrecognized archival location type '{}'".format(item_type))
+
+
+    def _list_existing(self):
+        for _, locations in (self._get_object_store_locations(), self._get_nfs_locations()):
+            for location in locations:
+                yield location['definition']['name'], location
+
+
+    def _existing_detail(self, existing):
+        return existing['definition']
+
+
     def _get_object_store_locations(self):
-        return self.rubrik.get('internal', '/archive/object_store')
+        return self._paginate('internal', '/archive/object_store')
 
 
     def _get_nfs_locations(self):
-        return self.rubrik.get('internal', '/archive/nfs')
+        return self._paginate('internal', '/archive/nfs')
 
 
     def _get_qstar_locations(self):
@@ -95,13 +136,17 @@ class ArchivalLocationConfig(RubrikConfigBase):
 
 
     def _add_object_store_location(self, config):
+        name = config['definition']['name']
+        self.logger.info("Restoring archival location `{}`".format(name))
+
         if 'Azure' == config['definition']['objectStoreType']:
-            config['definition']['secretKey'] = cli_ui.ask_password('Access Key')
-            config['definition']['pemFileContent'] = ask_multiline_string('RSA Key').strip()
+            secrets = self.secrets.get('archival_location/{}'.format(name), AZURE_SECRETS)
+            config['definition']['secretKey'] = secrets['secretKey']
+            config['definition']['pemFileContent'] = secrets['pemFileContent']
 
         # TODO: Handle S3 archives!
 
-        response = self.rubrik.post('internal', '/archive/object_store', config['definition'], timeout=120)
+        response = self.rubrik.post('internal', '/archive/object_store', config['definition'])
         created_on = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S%z')
 
         return {
@@ -114,13 +159,17 @@ class ArchivalLocationConfig(RubrikConfigBase):
 
 
     def _add_nfs_location(self, config):
-        encryption_password = cli_ui.ask_password('Encryption Password (leave blank to disable)')
+        name = config['definition']['name']
+        self.logger.info("Restoring archival location `{}`".format(name))
+
+        encryption_password = self.secrets.get('archival_location/{}'.format(name), NFS_SECRETS)['encryptionPassword']
+
         if not encryption_password.strip():
             config['definition']['disableEncryption'] = True
         else:
             config['definition']['encryptionPassword'] = encryption_password
 
-        response = self.rubrik.post('internal', '/archive/nfs', config['definition'], timeout=120)
+        response = self.rubrik.post('internal', '/archive/nfs', config['definition'])
         created_on = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S%z')
 
         return {
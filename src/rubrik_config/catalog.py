@@ -0,0 +1,317 @@
+import logging
+import os
+import sqlite3
+import threading
+
+from rubrik_config.serialization import canonical_json
+from rubrik_config.snapshot import (config_hash, content_dir_name, get_snapshot_format, is_legacy,
+                                    list_legacy_snapshots, list_snapshots, open_snapshot, recover_conversion)
+
+
+CATALOG_NAME = '.catalog.db'
+
+# Version of the tables, kept in the `user_version` of the database
+SCHEMA_VERSION = 4
+
+
+class Catalog:
+    """SQLite index of the snapshots stored under a backup root.
+
+    The catalog is kept up to date by `backup`. When it is created for a backup
+    root that already holds snapshots, the complete ones are indexed once,
+    along with the ones taken by versions of rbkcb before the catalog, which
+    are marked as `legacy`. They are indexed again when the catalog was
+    written by a version that hashed items differently. Snapshots whose
+    directory was deleted since, e.g. by retention pruning, are dropped
+    whenever the catalog is opened.
+
+    Items are hashed by their `config` alone, see `config_hash`.
+
+    Args:
+        root (str): The backup root.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, CATALOG_NAME)
+
+        os.makedirs(root, exist_ok=True)
+        is_new = not os.path.exists(self.path)
+
+        self.db = sqlite3.connect(self.path)
+        self.db.row_factory = sqlite3.Row
+        reindex = self._create_tables()
+
+        if is_new or reindex:
+            self._index_existing_snapshots()
+        else:
+            self.prune()
+
+
+    def add_snapshot(self, snapshot_id, snapshot_format, cluster_name, cluster_version, items, legacy=False):
+        """Record a snapshot and its items.
+
+        Args:
+            snapshot_id (str): The snapshot directory name.
+            snapshot_format (str): The layout of the snapshot.
+            cluster_name (str): Name of the backed up cluster.
+            cluster_version (str): Version of the backed up cluster.
+            items (list): One dict per item with its `configType`, `contentType`,
+                          `itemId`, `name`, `hash`, `size` and `path`.
+            legacy (bool): Whether the snapshot predates completion markers.
+        """
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?, ?)',
+                (snapshot_id, snapshot_format, cluster_name, cluster_version, len(items), int(legacy)))
+            self.db.execute('DELETE FROM items WHERE snapshot_id = ?', (snapshot_id, ))
+            self.db.executemany(
+                'INSERT INTO items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(snapshot_id, cluster_name, cluster_version, i['configType'], i['contentType'], i['itemId'],
+                  i['name'], i['hash'], i['size'], os.path.relpath(i['path'], self.root)) for i in items])
+
+
+    def index_snapshot(self, snapshot_id, legacy=False):
+        """Record a snapshot and its items, as found in its directory."""
+        path = os.path.join(self.root, snapshot_id)
+        snapshot = open_snapshot(path)
+        snapshot_format = get_snapshot_format(path)
+
+        items = []
+        for config_type in snapshot.config_types():
+            for item_id in snapshot.ids(config_type):
+                content = snapshot.read(config_type, item_id)
+                name = snapshot.name(config_type, item_id)
+                if not snapshot.manifest:
+                    # Legacy snapshots have no manifest, their file names are sanitized display names
+                    name = _display_name(content['config'], name)
+                items.append(_catalog_item(content, item_id, name, snapshot.location(config_type, item_id)))
+
+        if items:
+            self.add_snapshot(snapshot_id, snapshot_format,
+                              items[0]['clusterName'], items[0]['clusterVersion'], items, legacy)
+
+
+    def prune(self):
+        """Drop the snapshots whose directory no longer exists, and their items.
+        Snapshots moved away by an interrupted conversion are moved back and
+        indexed again instead.
+
+        Returns:
+            list: The IDs of the dropped snapshots.
+        """
+        pruned = []
+        for snapshot_id in [s['snapshot_id'] for s in self.snapshots()]:
+            path = os.path.join(self.root, snapshot_id)
+            if os.path.isdir(path):
+                continue
+
+            recover_conversion(path)
+            if os.path.isdir(path):
+                self.index_snapshot(snapshot_id, is_legacy(path))
+            else:
+                pruned.append(snapshot_id)
+
+        with self.db:
+            self.db.executemany('DELETE FROM items WHERE snapshot_id = ?', [(s, ) for s in pruned])
+            self.db.executemany('DELETE FROM snapshots WHERE snapshot_id = ?', [(s, ) for s in pruned])
+
+        return pruned
+
+
+    def snapshots(self):
+        """Return the indexed snapshots, oldest first."""
+        return [dict(r) for r in self.db.execute('SELECT * FROM snapshots ORDER BY snapshot_id')]
+
+
+    def items(self, snapshot_id=None, config_type=None, name=None):
+        """Return the indexed items matching all the given filters.
+
+        Args:
+            snapshot_id (str): Only items of this snapshot.
+            config_type (str): Only items of this config type.
+            name (str): Only items whose name matches this glob pattern.
+
+        Returns:
+            list: A dict per item. `path` is absolute.
+        """
+        query = 'SELECT * FROM items WHERE 1 = 1'
+        params = []
+        if snapshot_id:
+            query += ' AND snapshot_id = ?'
+            params.append(snapshot_id)
+        if config_type:
+            query += ' AND config_type = ?'
+            params.append(config_type)
+        if name:
+            query += ' AND name GLOB ?'
+            params.append(name)
+
+        rows = []
+        for r in self.db.execute(query + ' ORDER BY snapshot_id, config_type, name, item_id', params):
+            row = dict(r)
+            row['path'] = os.path.join(self.root, row['path'])
+            rows.append(row)
+
+        return rows
+
+
+    def close(self):
+        self.db.close()
+
+
+    # Private methods
+
+    def _create_tables(self):
+        # Returns whether the snapshots must be indexed again
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        reindex = False
+
+        with self.db:
+            if version < 2 and self._has_table('items'):
+                # Items were keyed by their names before they had IDs
+                self.db.execute('ALTER TABLE items RENAME TO items_v1')
+                self.db.execute('DROP INDEX IF EXISTS items_name')
+                self._create_items_table()
+                self.db.execute("""
+                    INSERT INTO items
+                    SELECT snapshot_id, cluster_name, cluster_version, config_type, content_type,
+                           name, name, hash, size, path
+                    FROM items_v1""")
+                self.db.execute('DROP TABLE items_v1')
+
+            if version < 3 and self._has_table('snapshots') and not self._has_column('snapshots', 'legacy'):
+                self.db.execute('ALTER TABLE snapshots ADD COLUMN legacy INTEGER NOT NULL DEFAULT 0')
+
+            if version < 4 and self._has_table('items'):
+                # Items were hashed along with their envelope, e.g. the cluster version
+                self.db.execute('DELETE FROM items')
+                self.db.execute('DELETE FROM snapshots')
+                reindex = True
+
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    snapshot_id TEXT PRIMARY KEY,
+                    format TEXT,
+                    cluster_name TEXT,
+                    cluster_version TEXT,
+                    item_count INTEGER,
+                    legacy INTEGER NOT NULL DEFAULT 0
+                )""")
+            self._create_items_table()
+            self.db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+        return reindex
+
+
+    def _create_items_table(self):
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                snapshot_id TEXT,
+                cluster_name TEXT,
+                cluster_version TEXT,
+                config_type TEXT,
+                content_type TEXT,
+                item_id TEXT,
+                name TEXT,
+                hash TEXT,
+                size INTEGER,
+                path TEXT,
+                PRIMARY KEY (snapshot_id, config_type, item_id)
+            )""")
+        self.db.execute('CREATE INDEX IF NOT EXISTS items_name ON items (name)')
+
+
+    def _has_table(self, name):
+        query = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?"
+        return self.db.execute(query, (name, )).fetchone() is not None
+
+
+    def _has_column(self, table, name):
+        return any(name == c['name'] for c in self.db.execute(f'PRAGMA table_info({table})'))
+
+
+    def _index_existing_snapshots(self):
+        # Snapshots taken before the catalog existed have no completion marker
+        snapshots = [(s, False) for s in list_snapshots(self.root)]
+        snapshots += [(s, True) for s in list_legacy_snapshots(self.root)]
+
+        for snapshot_id, legacy in snapshots:
+            try:
+                self.index_snapshot(snapshot_id, legacy)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logging.warning("`%s` isn't a readable snapshot, it is not indexed: %r" % (snapshot_id, e))
+
+
+class CatalogedSnapshotWriter:
+    """Snapshot writer that records every item it writes, and adds them to the
+    catalog once the snapshot is committed.
+
+    Args:
+        writer: The snapshot writer to delegate to, writing to the staging directory.
+        catalog (Catalog): The catalog of the backup root.
+        snapshot_format (str): The layout written by `writer`.
+        cluster (ClusterContext): The backed up cluster.
+        staging (SnapshotStaging): The staging directory of the snapshot.
+    """
+
+    def __init__(self, writer, catalog, snapshot_format, cluster, staging):
+        self.writer = writer
+        self.catalog = catalog
+        self.snapshot_format = snapshot_format
+        self.cluster = cluster
+        self.staging = staging
+
+        self._lock = threading.Lock()
+        self._items = []
+
+
+    @property
+    def path(self):
+        return self.writer.path
+
+
+    def write(self, content_type, item_id, name, content):
+        location = self.writer.write(content_type, item_id, name, content)
+
+        item = _catalog_item(content, item_id, name, location)
+        with self._lock:
+            self._items.append(item)
+
+        # Where the item is once the snapshot is committed, which is what gets logged
+        return self.staging.final_location(location)
+
+
+    def close(self):
+        self.writer.close()
+
+
+    def commit(self):
+        """Publish the snapshot and add it to the catalog. Only complete snapshots are cataloged."""
+        self.staging.commit()
+
+        items = [dict(i, path=self.staging.final_location(i['path'])) for i in self._items]
+        self.catalog.add_snapshot(self.staging.snapshot_id, self.snapshot_format,
+                                  self.cluster.name, self.cluster.version, items)
+
+
+def _display_name(config, default):
+    # The names the config types save their items under, see their `_write` calls
+    name = config.get('name') or config.get('definition', {}).get('name') or config.get('targetClusterName')
+    return name or default
+
+
+def _catalog_item(content, item_id, name, location):
+    data = canonical_json(content)
+
+    return {
+        'clusterName': content['clusterName'],
+        'clusterVersion': content['clusterVersion'],
+        'configType': content_dir_name(content['type']),
+        'contentType': content['type'],
+        'itemId': item_id,
+        'name': name,
+        'hash': config_hash(content),
+        'size': len(data),
+        'path': location
+    }
@@ -0,0 +1,52 @@
+import threading
+
+
+class ClusterContext:
+    """Metadata of the cluster behind a connection, fetched once and shared by
+    every config class created for that connection.
+
+    Args:
+        rubrik (Transport): The connection to the cluster.
+    """
+
+    def __init__(self, rubrik):
+        self.rubrik = rubrik
+
+        self._lock = threading.Lock()
+        self._cache = {}
+
+
+    @property
+    def id(self):
+        return self._cluster_me()['id']
+
+
+    @property
+    def name(self):
+        return self._cluster_me()['name']
+
+
+    @property
+    def version(self):
+        return self._cluster_me()['version']
+
+
+    @property
+    def node_ips(self):
+        return self._memoize('node_ips', lambda: [
+            node['ipAddress'] for node in self.rubrik.get('internal', '/cluster/me/node')['data']
+        ])
+
+
+    # Private methods
+
+    def _cluster_me(self):
+        return self._memoize('me', lambda: self.rubrik.get('v1', '/cluster/me'))
+
+
+    def _memoize(self, key, fetch):
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = fetch()
+
+            return self._cache[key]
@@ -1,67 +1,56 @@
 import datetime
 import json
+import logging
 import os
-
-import rubrik_cdm
-from urllib.parse import urlencode
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from rubrik_config.rubrik_config_base import RubrikConfigBase
 from rubrik_config.helpers import config_name, filter_fields
 
 
+# Minimum number of seconds between two progress lines
+PROGRESS_INTERVAL = 1
+
+
 class CustomReportConfig(RubrikConfigBase):
 
-    def __init__(self, path, rubrik, logger):
-        super().__init__(path, rubrik, logger)
+    def __init__(self, path, rubrik, logger, **kwargs):
+        super().__init__(path, rubrik, logger, **kwargs)
 
 
     def backup(self):
-        response = self.rubrik.get('internal', '/report?report_type=Custom&primary_cluster_id=local')
-        self.logger.info("%s Custom Reports found!" % response['total'])
+        total, reports = self._paginate('internal', '/report', {'report_type': 'Custom', 'primary_cluster_id': 'local'})
+        self.logger.info("%s Custom Reports found!" % total)
+
+        # Fetch the report details concurrently and save each one as soon as it arrives
+        started = reported = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.rubrik.get, 'internal', '/report/{}'.format(item['id']))
+                       for item in reports]
+
+            for n, future in enumerate(as_completed(futures), 1):
+                self._write_item(future.result(), self.config_name)
 
-        for item in response['data']:
-            self._write([self.rubrik.get('internal', '/report/{}'.format(item['id']))], self.config_name)
+                # The logger of the config type is only written out once it is done, progress is
+                # shown on the console as it happens
+                now = time.monotonic()
+                if now - reported >= PROGRESS_INTERVAL or n == len(futures):
+                    reported = now
+                    rate = n / max(now - started, 0.001)
+                    logging.info("%s/%s Custom Reports fetched (%.1f requests/s)" % (n, len(futures), rate))
 
-        return response['total']
+        return len(futures)
 
 
     def restore(self, items):
-        jobs = []
-
-        for item in items:
-            config = filter_fields(item['config'], [
-                'name',
-                'reportType',
-                'reportTemplate',
-                'chart0',
-                'chart1',
-                'table'
-                'filters'
-            ])
-
-            self.logger.info("Restoring custom report `{}`".format(config['name']))
-            
-            try:
-                response = self.rubrik.post('internal', '/report', config, timeout=120)
-                created_on = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S%z')
-                jobs += ({ 
-                    'id': response['id'], 
-                    'type': 'CREATE_CUSTOM_REPORT', 
-                    'name': config['name'], 
-                    'createdOn': created_on,
-                    'configType': self.config_name
-                }, )
-            
-            except rubrik_cdm.exceptions.APICallException as e:
-                self.logger.error(e)
-
-        return jobs
+        return self._restore_items(items, self._restore_item)
 
 
     def status(self, job):
         job_status = None
 
-        if 'CREATE_CUSTOM_REPORT' == job['type']:
+        if job['type'] in ('CREATE_CUSTOM_REPORT', 'UPDATE_CUSTOM_REPORT'):
             status = 'SUCCEEDED'
             start_time = job['createdOn']
             end_time = job['createdOn']
@@ -74,4 +63,50 @@ class CustomReportConfig(RubrikConfigBase):
                 job['name']
             ]
 
-        return job_status
\ No newline at end of file
+        return job_status
+
+
+    # Private methods
+
+    def _restore_item(self, item):
+        config = filter_fields(item['config'], [
+            'name',
+            'reportType',
+            'reportTemplate',
+            'chart0',
+            'chart1',
+            'table'
+            'filters'
+        ])
+
+        self.logger.info("Restoring custom report `{}`".format(config['name']))
+        
+        action, existing = self._plan(config['name'], config)
+        if 'skip' == action:
+            return None
+
+        if 'update' == action:
+            # The report type and template of an existing report can't be changed
+            update = { k: v for k, v in config.items() if k not in ('reportType', 'reportTemplate') }
+            self.rubrik.patch('internal', '/report/{}'.format(existing['id']), update)
+            job_id = existing['id']
+        else:
+            job_id = self.rubrik.post('internal', '/report', config)['id']
+        created_on = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S%z')
+        return { 
+            'id': job_id, 
+            'type': 'UPDATE_CUSTOM_REPORT' if 'update' == action else 'CREATE_CUSTOM_REPORT', 
+            'name': config['name'], 
+            'createdOn': created_on,
+            'configType': self.config_name
+        }
+
+
+    def _list_existing(self):
+        _, reports = self._paginate('internal', '/report', {'report_type': 'Custom', 'primary_cluster_id': 'local'})
+        return ((r['name'], r) for r in reports)
+
+
+    def _existing_detail(self, existing):
+        # The report listing doesn't include the charts, table and filters of a report
+        return self.rubrik.get('internal', '/report/{}'.format(existing['id']))
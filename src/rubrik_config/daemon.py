@@ -0,0 +1,159 @@
+import logging
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rubrik_config.registry import config_class, config_types
+from rubrik_config.serialization import read_file, write_file
+
+
+STATE_NAME = '.daemon_state.json'
+
+
+class Daemon:
+    """Back up the configuration of a cluster whenever it changes.
+
+    The list endpoints of every config type are polled on their own interval,
+    over a connection kept open for the lifetime of the daemon. A backup is
+    only cut when the fingerprint of at least one config type differs from
+    the one of the latest backup, or when the latest full backup is older than
+    `full_interval`. Other backups are incremental if the runner is.
+
+    The fingerprints of the latest backup are kept in `<path>/.daemon_state.json`,
+    so a restarted daemon doesn't back up an unchanged configuration again.
+
+    Args:
+        runner (Runner): Runner backing up the cluster.
+        poll_interval (float): Default polling interval of the config types, in seconds.
+        intervals (dict): Polling interval of specific config types, in seconds.
+        full_interval (float): Maximum age of the latest full backup, in seconds.
+                               Full backups are only cut on changes when 0.
+    """
+
+    def __init__(self, runner, poll_interval=300, intervals={}, full_interval=86400):
+        self.runner = runner
+        self.poll_interval = poll_interval
+        self.intervals = intervals
+        self.full_interval = full_interval
+
+        self.state_path = os.path.join(runner.path, STATE_NAME)
+
+        self._stopped = threading.Event()
+        self._fingerprints = {}
+        self._instances = {}
+
+
+    def run(self):
+        if not self.runner.rubrik:
+            self.runner._connect(self.runner._read_credentials())
+
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+
+        state = self._read_state()
+        next_polls = { config_type: time.monotonic() for config_type in config_types() }
+
+        logging.info("Polling %s config types for changes%s" % (
+            len(next_polls), f", with a full backup at least every {self.full_interval}s" if self.full_interval else ''))
+
+        try:
+            while not self._stopped.is_set():
+                now = time.monotonic()
+                due = sorted(c for c, at in next_polls.items() if at <= now)
+
+                if due:
+                    # Every cycle starts a new API call report
+                    self.runner.recorder.reset()
+
+                    changed = self._poll(due)
+                    for config_type in due:
+                        next_polls[config_type] = now + self.intervals.get(config_type, self.poll_interval)
+
+                    changed = [c for c in changed if self._fingerprints[c] != state['fingerprints'].get(c)]
+                    full = not state['lastFull'] or \
+                        (self.full_interval and time.time() - state['lastFull'] >= self.full_interval)
+
+                    if changed or full:
+                        state = self._backup(state, changed, full)
+
+                self._stopped.wait(max(min(next_polls.values()) - time.monotonic(), 0))
+
+        except KeyboardInterrupt:
+            pass
+
+        logging.info('Daemon stopped')
+
+
+    def stop(self):
+        self._stopped.set()
+
+
+    # Private methods
+
+    def _poll(self, due):
+        # Returns the config types whose fingerprint could be computed
+        with ThreadPoolExecutor(max_workers=max(self.runner.workers, 1)) as executor:
+            fingerprints = dict(zip(due, executor.map(self._fingerprint, due)))
+
+        polled = []
+        for config_type, fingerprint in fingerprints.items():
+            if fingerprint:
+                self._fingerprints[config_type] = fingerprint
+                polled.append(config_type)
+
+        return polled
+
+
+    def _fingerprint(self, config_type):
+        try:
+            if config_type not in self._instances:
+                klass = config_class(config_type)
+                self._instances[config_type] = klass(self.runner.path, self.runner.rubrik,
+                                                     logging.getLogger(f'rubrik_config.daemon.{config_type}'),
+                                                     cluster=self.runner.cluster, page_size=self.runner.page_size)
+
+            return self._instances[config_type].fingerprint()
+
+        except Exception as e:
+            logging.error("Polling of `%s` failed: %s" % (config_type, e))
+            return None
+
+
+    def _backup(self, state, changed, full):
+        if not state['backupId']:
+            logging.info("No backup taken by the daemon yet")
+        elif changed:
+            logging.info("Configuration changed: %s" % ', '.join(changed))
+        else:
+            logging.info("Latest full backup is too old")
+
+        try:
+            result = self.runner.backup(incremental=False if full else None)
+        except Exception as e:
+            # The fingerprints are left as they were so the next poll tries again
+            logging.error("Backup failed: %s" % e)
+            return state
+
+        state = {
+            'backupId': result['backupId'],
+            'lastFull': time.time() if full or not self.runner.incremental else state['lastFull'],
+            'fingerprints': dict(state['fingerprints'], **self._fingerprints)
+        }
+        self._write_state(state)
+
+        return state
+
+
+    def _read_state(self):
+        try:
+            return read_file(self.state_path)
+        except FileNotFoundError:
+            return { 'backupId': None, 'lastFull': None, 'fingerprints': {} }
+
+
+    def _write_state(self, state):
+        tmp_path = self.state_path + '.tmp'
+        write_file(tmp_path, state)
+        os.replace(tmp_path, self.state_path)
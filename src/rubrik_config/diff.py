@@ -0,0 +1,126 @@
+def diff_values(old, new, path=''):
+    """Return the field-level differences between two JSON values.
+
+    Dicts are compared key by key and lists index by index, so the path of a
+    difference points at the innermost field that changed.
+
+    >>> diff_values({'a': 1, 'b': [1, 2]}, {'a': 2, 'b': [1]})
+    [('changed', 'a', 1, 2), ('removed', 'b[1]', 2, None)]
+
+    Returns:
+        list: An `(operation, path, old, new)` tuple per difference, where the
+              operation is one of `added`, `removed` or `changed`.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        changes = []
+        for key in sorted(set(old) | set(new), key=str):
+            key_path = f"{path}.{key}" if path else str(key)
+            if key not in old:
+                changes.append(('added', key_path, None, new[key]))
+            elif key not in new:
+                changes.append(('removed', key_path, old[key], None))
+            else:
+                changes += diff_values(old[key], new[key], key_path)
+        return changes
+
+    if isinstance(old, list) and isinstance(new, list):
+        changes = []
+        for i in range(max(len(old), len(new))):
+            index_path = f"{path}[{i}]"
+            if i >= len(old):
+                changes.append(('added', index_path, None, new[i]))
+            elif i >= len(new):
+                changes.append(('removed', index_path, old[i], None))
+            else:
+                changes += diff_values(old[i], new[i], index_path)
+        return changes
+
+    if old != new:
+        return [('changed', path, old, new)]
+
+    return []
+
+
+def diff_snapshots(old_hashes, new_hashes, read_old, read_new, old_names={}, new_names={}):
+    """Compare two snapshots item by item.
+
+    Items are matched by config type and ID, so a renamed item is reported as
+    changed rather than removed and added. Items left without a match, e.g.
+    when comparing backups of different clusters, or taken before and after a
+    restore, are then matched by config type and display name, provided no
+    other unmatched item of either side has that name. The IDs of such items
+    are not compared.
+
+    Items whose hashes are equal are skipped without being read, the others
+    are read and their configs compared field by field. Items that only differ
+    in their envelope, e.g. the cluster version, are not reported.
+
+    Args:
+        old_hashes (dict): The item hashes of the old snapshot, by config type and ID.
+        new_hashes (dict): The item hashes of the new snapshot, by config type and ID.
+        read_old (function): Returns an item of the old snapshot given its config type and ID.
+        read_new (function): Returns an item of the new snapshot given its config type and ID.
+        old_names (dict): The display names of the items of the old snapshot by config type and ID.
+        new_names (dict): The display names of the items of the new snapshot by config type and ID.
+                          Items without one are shown and matched by ID.
+
+    Returns:
+        list: A dict per added, removed or changed item with its `configType`,
+              `itemId`, `name`, `status` and field level `changes`. The ID is
+              the one in the new snapshot, unless the item was removed.
+    """
+    result = []
+    for config_type in sorted(set(old_hashes) | set(new_hashes)):
+        old = old_hashes.get(config_type, {})
+        new = new_hashes.get(config_type, {})
+        old_type_names = old_names.get(config_type, {})
+        new_type_names = new_names.get(config_type, {})
+
+        pairs = [(i, i) for i in set(old) & set(new)]
+        pairs += _match_by_name(set(old) - set(new), set(new) - set(old), old_type_names, new_type_names)
+
+        matched_old = { o for o, _ in pairs }
+        matched_new = { n for _, n in pairs }
+        pairs += [(i, None) for i in set(old) - matched_old]
+        pairs += [(None, i) for i in set(new) - matched_new]
+
+        entries = []
+        for old_id, new_id in pairs:
+            item_id = new_id or old_id
+            name = new_type_names.get(new_id) or old_type_names.get(old_id) or item_id
+
+            if old_id is None:
+                status, changes = 'added', []
+            elif new_id is None:
+                status, changes = 'removed', []
+            elif old[old_id] == new[new_id]:
+                continue
+            else:
+                status = 'changed'
+                changes = diff_values(read_old(config_type, old_id)['config'], read_new(config_type, new_id)['config'])
+                if old_id != new_id:
+                    changes = [c for c in changes if 'id' != c[1]]
+                if not changes:
+                    continue
+
+            entries.append({ 'configType': config_type, 'itemId': item_id, 'name': name,
+                             'status': status, 'changes': changes })
+
+        result += sorted(entries, key=lambda e: (e['name'], e['itemId']))
+
+    return result
+
+
+def _match_by_name(old_ids, new_ids, old_names, new_names):
+    # Pairs of old and new IDs of the items whose display names are unique and equal on both sides
+    def by_name(ids, names):
+        ids_by_name = {}
+        for item_id in ids:
+            if item_id in names:
+                ids_by_name.setdefault(names[item_id], []).append(item_id)
+        return { name: i[0] for name, i in ids_by_name.items() if 1 == len(i) }
+
+    old_by_name = by_name(old_ids, old_names)
+    new_by_name = by_name(new_ids, new_names)
+
+    return [(old_by_name[name], new_by_name[name]) for name in old_by_name if name in new_by_name]
@@ -1,74 +1,32 @@
 import datetime
 import json
 import os
-from urllib.parse import urlencode
 
-import rubrik_cdm
 from rubrik_config.helpers import filter_fields, config_name
 from rubrik_config.rubrik_config_base import RubrikConfigBase
 
 
 class FilesetTemplateConfig(RubrikConfigBase):
 
-    def __init__(self, path, rubrik, logger):
-        super().__init__(path, rubrik, logger)
+    def __init__(self, path, rubrik, logger, **kwargs):
+        super().__init__(path, rubrik, logger, **kwargs)
         
 
     def backup(self):
-        response = self.rubrik.get('v1', '/fileset_template?{}'.format(urlencode({'primary_cluster_id': 'local'})))
-        self.logger.info("%s Fileset Templates found!" % response['total'])
+        total, fileset_templates = self._paginate('v1', '/fileset_template', {'primary_cluster_id': 'local'})
+        self.logger.info("%s Fileset Templates found!" % total)
 
-        fileset_templates = response['data']
-        
-        self._write(fileset_templates, self.config_name)
-
-        return response['total']
+        return self._write(fileset_templates, self.config_name)
 
 
     def restore(self, items):
-        jobs = []
-
-        for item in items:
-            config = filter_fields(item['config'], [
-                'name',
-                'excludes',
-                'includes',
-                'useWindowsVss',
-                'exceptions',
-                'allowBackupNetworkMounts',
-                'allowBackupHiddenFoldersInNetworkMounts',
-                'operatingSystemType',
-                'shareType',
-                'preBackupScript',
-                'postBackupScript',
-                'backupScriptTimeout',
-                'backupScriptErrorHandling',
-                'isArrayEnabled'
-            ])
-
-            self.logger.info("Restoring fileset template `{}`".format(config['name']))
-            
-            try:
-                response = self.rubrik.post('v1', '/fileset_template', config)
-                created_on = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S%z')
-                jobs += ({ 
-                    'id': response['id'], 
-                    'type': 'CREATE_FILESET_TEMPLATE', 
-                    'name': config['name'], 
-                    'createdOn': created_on,
-                    'configType': self.config_name
-                }, )
-            
-            except rubrik_cdm.exceptions.APICallException as e:
-                self.logger.error(e)
-
-        return jobs
+        return self._restore_items(items, self._restore_item)
 
 
     def status(self, job):
         job_status = None
 
-        if 'CREATE_FILESET_TEMPLATE' == job['type']:
+        if job['type'] in ('CREATE_FILESET_TEMPLATE', 'UPDATE_FILESET_TEMPLATE'):
             status = 'SUCCEEDED'
             start_time = job['createdOn']
             end_time = job['createdOn']
@@ -82,3 +40,49 @@ class FilesetTemplateConfig(RubrikConfigBase):
             ]
 
         return job_status
+
+
+    # Private methods
+
+    def _restore_item(self, item):
+        config = filter_fields(item['config'], [
+            'name',
+            'excludes',
+            'includes',
+            'useWindowsVss',
+            'exceptions',
+            'allowBackupNetworkMounts',
+            'allowBackupHiddenFoldersInNetworkMounts',
+            'operatingSystemType',
+            'shareType',
+            'preBackupScript',
+            'postBackupScript',
+            'backupScriptTimeout',
+            'backupScriptErrorHandling',
+            'isArrayEnabled'
+        ])
+
+        self.logger.info("Restoring fileset template `{}`".format(config['name']))
+        
+        action, existing = self._plan(config['name'], config)
+        if 'skip' == action:
+            return None
+
+        if 'update' == action:
+            self.rubrik.patch('v1', '/fileset_template/{}'.format(existing['id']), config)
+            job_id = existing['id']
+        else:
+            job_id = self.rubrik.post('v1', '/fileset_template', config)['id']
+        created_on = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S%z')
+        return { 
+            'id': job_id, 
+            'type': 'UPDATE_FILESET_TEMPLATE' if 'update' == action else 'CREATE_FILESET_TEMPLATE', 
+            'name': config['name'], 
+            'createdOn': created_on,
+            'configType': self.config_name
+        }
+
+
+    def _list_existing(self):
+        _, fileset_templates = self._paginate('v1', '/fileset_template', {'primary_cluster_id': 'local'})
+        return ((t['name'], t) for t in fileset_templates)
@@ -0,0 +1,214 @@
+import contextlib
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cli_ui
+import yaml
+
+from rubrik_config.helpers import secure_filename
+from rubrik_config.serialization import write_file
+
+
+#: Runner options an inventory entry may override for its cluster
+RUNNER_OPTIONS = ('workers', 'page_size', 'pool_size', 'rate_limit', 'retries')
+
+SUMMARY_NAME = 'fleet_summary.json'
+
+
+def read_inventory(path):
+    """Read the clusters of an inventory file.
+
+    The inventory is a YAML mapping with a `clusters` list. Every cluster has an
+    `address`, a `name` naming its snapshot subtree (the address by default) and
+    an `api_token`, or the environment variable holding it in `api_token_env`.
+    The options of the `defaults` mapping apply to every cluster.
+
+    Example::
+
+        defaults:
+          workers: 4
+        clusters:
+          - name: prod-east
+            address: 10.0.1.10
+            api_token_env: RUBRIK_PROD_EAST_TOKEN
+          - address: 10.0.2.10
+            api_token: eyJ0eXAiOiJKV1Qi...
+            rate_limit: 20
+
+    Args:
+        path (str): Path of the inventory file.
+
+    Returns:
+        list: The clusters, with their defaults applied and their token resolved.
+    """
+    with open(path, 'r') as f:
+        inventory = yaml.safe_load(f) or {}
+
+    defaults = inventory.get('defaults') or {}
+    clusters = []
+    for n, entry in enumerate(inventory.get('clusters') or [], 1):
+        cluster = dict(defaults, **entry)
+
+        if not cluster.get('address'):
+            raise ValueError(f"Cluster #{n} of the inventory has no address")
+        cluster['name'] = str(cluster.get('name') or cluster['address'])
+
+        if 'api_token_env' in cluster:
+            cluster['api_token'] = os.environ.get(cluster['api_token_env'])
+        if not cluster.get('api_token'):
+            raise ValueError(f"No API token for cluster `{cluster['name']}`")
+
+        clusters.append(cluster)
+
+    names = [secure_filename(c['name']) for c in clusters]
+    duplicates = sorted({ n for n in names if names.count(n) > 1 })
+    if duplicates:
+        raise ValueError(f"Duplicate cluster names in the inventory: {', '.join(duplicates)}")
+
+    return clusters
+
+
+class Fleet:
+    """Back up the clusters of an inventory concurrently.
+
+    Each cluster is backed up by its own `Runner` in a separate process, into
+    the `<path>/<cluster name>` subtree.
+
+    Args:
+        path (str): Root path of the snapshot subtrees.
+        clusters (list): The clusters, as returned by `read_inventory`.
+        max_clusters (int): Maximum number of clusters backed up at once.
+        runner_options (dict): Options of the runners, see `Runner`.
+    """
+
+    def __init__(self, path, clusters, max_clusters=4, **runner_options):
+        self.path = path
+        self.clusters = clusters
+        self.max_clusters = max_clusters
+        self.runner_options = runner_options
+
+
+    def backup(self):
+        os.makedirs(self.path, exist_ok=True)
+
+        logging.info("Backing up %s clusters, %s at a time" % (len(self.clusters), self.max_clusters))
+
+        started = time.monotonic()
+        results = []
+        with ProcessPoolExecutor(max_workers=max(self.max_clusters, 1)) as executor:
+            futures = [executor.submit(_backup_cluster, self.path, c, self.runner_options)
+                       for c in self.clusters]
+
+            for future in as_completed(futures):
+                result = future.result()
+                if result['error']:
+                    logging.error("Backup of cluster `%s` failed: %s" % (result['cluster'], result['error']))
+                else:
+                    logging.info("Cluster `%s` backed up in %.2fs" % (result['cluster'], result['elapsed']))
+                results.append(result)
+
+        elapsed = time.monotonic() - started
+
+        self._write_summary(results, elapsed)
+        self._log_summary(results, elapsed)
+
+        return results
+
+
+    # Private methods
+
+    def _write_summary(self, results, elapsed):
+        summary = {
+            'createdOn': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'elapsed': elapsed,
+            'clusters': sorted(results, key=lambda r: r['cluster'])
+        }
+        write_file(os.path.join(self.path, SUMMARY_NAME), summary)
+
+
+    def _log_summary(self, results, elapsed):
+        results = sorted(results, key=lambda r: r['cluster'])
+        failed = [r for r in results if r['error']]
+
+        logging.info("Fleet backup completed in %.2fs: %s succeeded, %s failed" % (
+            elapsed, len(results) - len(failed), len(failed)))
+
+        summary_rows = list(map(
+            lambda r: [
+                (cli_ui.red, 'FAILED') if r['error'] else (cli_ui.green, 'SUCCEEDED'),
+                (cli_ui.bold, r['cluster']),
+                (cli_ui.lightgray, r['address']),
+                (cli_ui.lightgray, r['backupId'] or ''),
+                (cli_ui.lightgray, r['count']),
+                (cli_ui.lightgray, '%.2fs' % r['elapsed'])],
+            results
+        ))
+        summary_rows.append([
+            (cli_ui.lightgray, ''),
+            (cli_ui.bold, 'total'),
+            (cli_ui.lightgray, ''),
+            (cli_ui.lightgray, ''),
+            (cli_ui.lightgray, sum(r['count'] for r in results)),
+            (cli_ui.bold, '%.2fs' % elapsed)])
+
+        print()
+        cli_ui.info_table(summary_rows, headers=['Status', 'Cluster', 'Address', 'Backup Id', 'Items', 'Wall time'])
+        print()
+
+
+def _backup_cluster(path, cluster, runner_options):
+    # Runs in a worker process. The console output of the runner is dropped
+    # and its log records are prefixed with the cluster name, so the clusters
+    # backed up at the same time can be told apart.
+    from rubrik_config.runner import Runner
+
+    name = cluster['name']
+
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    if not root.handlers:
+        root.addHandler(logging.StreamHandler())
+    for handler in root.handlers:
+        handler.setFormatter(logging.Formatter(f"[%(asctime)s] [%(levelname)s] [{name}] %(message)s"))
+
+    options = dict(runner_options, **{ k: cluster[k] for k in RUNNER_OPTIONS if k in cluster })
+    if options.get('prometheus_path'):
+        # One metrics file per cluster, the textfile collector reads them all
+        base, ext = os.path.splitext(options['prometheus_path'])
+        options['prometheus_path'] = f"{base}.{secure_filename(name)}{ext}"
+
+    result = { 'cluster': name, 'address': cluster['address'], 'backupId': None, 'count': 0, 'error': None }
+    started = time.monotonic()
+    try:
+        with _stdout_dropped():
+            runner = Runner(os.path.join(path, secure_filename(name)), **options)
+            runner.connect({ 'address': cluster['address'], 'api_token': cluster['api_token'] })
+            result.update(runner.backup())
+
+    except Exception as e:
+        logging.error(e)
+        result['error'] = str(e) or e.__class__.__name__
+
+    result['elapsed'] = time.monotonic() - started
+
+    return result
+
+
+@contextlib.contextmanager
+def _stdout_dropped():
+    # Redirects the file descriptor of stdout to /dev/null, and restores it
+    sys.stdout.flush()
+    saved = os.dup(sys.stdout.fileno())
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    os.close(devnull)
+
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, sys.stdout.fileno())
+        os.close(saved)
@@ -1,15 +1,8 @@
-import importlib
+import hashlib
 import os
 import re
 
 import cli_ui
-import rubrik_cdm
-
-
-def config_class(module_name):
-    class_name = module_name.title().replace('_', '') + 'Config'
-    klass = getattr(importlib.import_module('rubrik_config.'+module_name), class_name)
-    return klass
 
 
 def config_name(obj):
@@ -58,6 +51,21 @@ def ask_or_default(name, label, defaults={}):
     return result
 
 
+def item_id(item, name):
+    """Return the stable ID of an item: its ID on the cluster, or a hash of
+    its name for the items that have none.
+
+    >>> item_id({'id': 'SlaDomain:::1', 'name': 'Gold'}, 'Gold')
+    'SlaDomain:::1'
+    >>> item_id({'name': 'Gold'}, 'Gold')
+    'name-6249df4367d0a2e0'
+    """
+    if item.get('id'):
+        return str(item['id'])
+
+    return 'name-' + hashlib.sha256(name.encode('utf-8')).hexdigest()[:16]
+
+
 def status_color(status):
     color = cli_ui.yellow
     if status == 'SUCCEEDED': color = cli_ui.green
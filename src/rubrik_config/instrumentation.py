@@ -0,0 +1,171 @@
+import math
+import os
+import re
+import threading
+import time
+
+from rubrik_config.serialization import write_file
+
+
+def endpoint_template(api_version, api_endpoint):
+    """Return the endpoint with its query string dropped and its IDs replaced.
+
+    >>> endpoint_template('internal', '/report/CustomReport:::1234?x=1')
+    '/internal/report/{id}'
+    """
+    path = api_endpoint.split('?')[0]
+    segments = ['{id}' if not re.fullmatch('[a-z_]+', s) else s for s in path.split('/') if s]
+
+    return '/' + '/'.join([api_version] + segments)
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted values.
+
+    >>> percentile(list(range(1, 21)), 95)
+    19
+    """
+    if not values:
+        return 0
+
+    return values[min(max(math.ceil(p * len(values) / 100) - 1, 0), len(values) - 1)]
+
+
+class CallRecorder:
+    """Record of the API calls made during a run, and the reports built from it.
+
+    Args:
+        slowest (int): Number of slowest calls listed in the summary.
+    """
+
+    def __init__(self, slowest=10):
+        self.slowest = slowest
+
+        self._lock = threading.Lock()
+        self._calls = []
+        self._started = time.time()
+
+
+    def record(self, method, api_version, api_endpoint, status, latency, size, retries):
+        """Record a call.
+
+        Args:
+            method (str): The HTTP method.
+            api_version (str): The API version of the endpoint.
+            api_endpoint (str): The endpoint that was called.
+            status (int): The HTTP status of the last attempt, 0 if no
+                          response was received.
+            latency (float): Duration of the call in seconds, retries included.
+            size (int): Bytes sent and received.
+            retries (int): Number of retries of the call.
+        """
+        call = {
+            'method': method,
+            'endpoint': endpoint_template(api_version, api_endpoint),
+            'url': f"/{api_version}{api_endpoint}",
+            'status': status,
+            'latency': latency,
+            'bytes': size,
+            'retries': retries
+        }
+        with self._lock:
+            self._calls.append(call)
+
+
+    def reset(self):
+        """Forget the recorded calls, e.g. between the backups of a long-running process."""
+        with self._lock:
+            self._calls = []
+            self._started = time.time()
+
+
+    def summary(self):
+        with self._lock:
+            calls = list(self._calls)
+
+        groups = {}
+        for call in calls:
+            groups.setdefault((call['method'], call['endpoint']), []).append(call)
+
+        endpoints = []
+        for (method, endpoint), group in sorted(groups.items()):
+            latencies = sorted(c['latency'] for c in group)
+            endpoints.append({
+                'method': method,
+                'endpoint': endpoint,
+                'calls': len(group),
+                'errors': len([c for c in group if not 200 <= c['status'] < 300]),
+                'retries': sum(c['retries'] for c in group),
+                'bytes': sum(c['bytes'] for c in group),
+                'latencySum': sum(latencies),
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'max': latencies[-1]
+            })
+
+        slowest = sorted(calls, key=lambda c: c['latency'], reverse=True)[:self.slowest]
+
+        return {
+            'totalCalls': len(calls),
+            'totalBytes': sum(c['bytes'] for c in calls),
+            'duration': time.time() - self._started,
+            'endpoints': endpoints,
+            'slowest': [
+                { k: c[k] for k in ('method', 'url', 'status', 'latency', 'retries') } for c in slowest
+            ]
+        }
+
+
+    def write_summary(self, path):
+        write_file(path, self.summary())
+
+
+    def write_prometheus(self, path, action, labels={}):
+        """Write the summary in the format of the node_exporter textfile collector.
+
+        The file is replaced atomically so the collector never reads a partial one.
+
+        Args:
+            path (str): Path of the `.prom` file.
+            action (str): The rbkcb action of the run, used as a label.
+            labels (dict): Labels added to every sample.
+        """
+        summary = self.summary()
+
+        lines = []
+        def sample(name, sample_labels, value):
+            label_text = ','.join('{}="{}"'.format(k, v) for k, v in dict(sample_labels, action=action, **labels).items())
+            lines.append(f"{name}{{{label_text}}} {value}")
+
+        def metric(name, metric_type, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for sample_labels, value in samples:
+                sample(name, sample_labels, value)
+
+        def per_endpoint(key):
+            return [({ 'method': e['method'], 'endpoint': e['endpoint'] }, e[key]) for e in summary['endpoints']]
+
+        metric('rbkcb_api_calls_total', 'counter', 'API calls made to the cluster.', per_endpoint('calls'))
+        metric('rbkcb_api_errors_total', 'counter', 'API calls that failed.', per_endpoint('errors'))
+        metric('rbkcb_api_retries_total', 'counter', 'Retries of API calls.', per_endpoint('retries'))
+        metric('rbkcb_api_bytes_total', 'counter', 'Bytes sent to and received from the cluster.', per_endpoint('bytes'))
+
+        latencies = []
+        for e in summary['endpoints']:
+            for quantile, key in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')):
+                latencies.append(({ 'method': e['method'], 'endpoint': e['endpoint'], 'quantile': quantile }, e[key]))
+        metric('rbkcb_api_latency_seconds', 'summary', 'Latency of API calls.', latencies)
+        for endpoint_labels, latency_sum in per_endpoint('latencySum'):
+            sample('rbkcb_api_latency_seconds_sum', endpoint_labels, latency_sum)
+        for endpoint_labels, calls in per_endpoint('calls'):
+            sample('rbkcb_api_latency_seconds_count', endpoint_labels, calls)
+
+        metric('rbkcb_last_run_timestamp_seconds', 'gauge', 'End time of the last run.', [({}, time.time())])
+        metric('rbkcb_last_run_duration_seconds', 'gauge', 'Duration of the last run.', [({}, summary['duration'])])
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
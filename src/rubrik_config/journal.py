@@ -0,0 +1,87 @@
+import os
+import threading
+from datetime import datetime
+
+from rubrik_config.serialization import dumps, loads
+
+
+class RestoreJournal:
+    """Append-only JSON-lines journal of a restore.
+
+    Every record is flushed and fsynced before `record` returns, so the journal
+    survives a crash of the process. The records written during a restore are:
+
+    * `start`: the backup being restored.
+    * `planned`: an item that is part of the restore.
+    * `post`: an item is about to be sent to the cluster.
+    * `done`: an item has been handled, with the job it initiated, if any.
+    * `failed`: the API calls of an item failed. It is still to do.
+    * `resume`: the restore was resumed.
+    * `finished`: every planned item has been handled.
+
+    Args:
+        path (str): Path of the journal file.
+        resume (bool): Append to an existing journal instead of starting a new one.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab' if resume else 'wb')
+
+
+    def record(self, event, **fields):
+        self.record_many(event, [fields])
+
+
+    def record_many(self, event, records):
+        """Append several records of the same event with a single fsync."""
+        created_on = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S%z')
+        lines = b''.join(dumps(dict(r, event=event, createdOn=created_on)) + b'\n' for r in records)
+
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+
+    def close(self):
+        self._file.close()
+
+
+    @staticmethod
+    def replay(path):
+        """Rebuild the state of a restore from its journal.
+
+        Returns:
+            dict: The `backupId` and `filters` of the restore, the `planned`
+                  items, the `done` items by (config type, hash), the error of
+                  the `failed` items that weren't done since by (config type,
+                  hash) and whether the restore `finished`.
+        """
+        state = { 'backupId': None, 'filters': {}, 'planned': [], 'done': {}, 'failed': {}, 'finished': False }
+
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    record = loads(line)
+                except ValueError:
+                    # The last record may have been torn by a crash
+                    continue
+
+                event = record['event']
+                if 'start' == event:
+                    state['backupId'] = record['backupId']
+                    state['filters'] = record['filters']
+                elif 'planned' == event:
+                    state['planned'].append(record)
+                elif 'done' == event:
+                    state['done'][(record['configType'], record['hash'])] = record['job']
+                    state['failed'].pop((record['configType'], record['hash']), None)
+                elif 'failed' == event:
+                    state['failed'][(record['configType'], record['hash'])] = record['error']
+                elif 'finished' == event:
+                    state['finished'] = True
+
+        return state
@@ -0,0 +1,88 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """Client side token bucket with an adaptive concurrency limit.
+
+    Requests are admitted at up to `rate` per second, with bursts of up to
+    `burst`, and only while fewer than the current concurrency limit are in
+    flight. The limit follows AIMD: it grows by one per round of requests
+    answered in time and is halved when the cluster answers slower than
+    `latency_target` or signals overload. It is halved at most once per round:
+    requests sent before the latest decrease don't decrease it again.
+
+    Args:
+        rate (float): Sustained number of requests per second.
+        burst (int): Size of the token bucket. Defaults to `rate`.
+        max_concurrency (int): Upper bound of the concurrency limit.
+        min_concurrency (int): Lower bound of the concurrency limit.
+        latency_target (float): Latency, in seconds, above which the
+                                concurrency limit is decreased.
+    """
+
+    def __init__(self, rate=100, burst=None, max_concurrency=10, min_concurrency=1, latency_target=5):
+        if rate <= 0:
+            raise ValueError(f"The rate limit must be greater than 0, got {rate}")
+
+        self.rate = rate
+        self.burst = burst if burst else max(rate, 1)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.latency_target = latency_target
+
+        self.concurrency = float(max_concurrency)
+        self.throttled = 0
+
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._in_flight = 0
+        self._decreased = float('-inf')
+        self._cond = threading.Condition()
+
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        with self._cond:
+            waited = False
+            while True:
+                self._refill()
+                if self._in_flight < int(self.concurrency) and self._tokens >= 1:
+                    self._tokens -= 1
+                    self._in_flight += 1
+                    if waited:
+                        self.throttled += 1
+                    return
+
+                waited = True
+                self._cond.wait(timeout=max((1 - self._tokens) / self.rate, 0.01))
+
+
+    def release(self, latency, overloaded=False):
+        """Record the outcome of a request admitted by `acquire`.
+
+        Args:
+            latency (float): Duration of the request, in seconds.
+            overloaded (bool): Whether the cluster signaled it is overloaded.
+        """
+        with self._cond:
+            self._in_flight -= 1
+
+            now = time.monotonic()
+            if overloaded or latency > self.latency_target:
+                # The responses to a burst sent under the previous limit only count once
+                if now - latency >= self._decreased:
+                    self.concurrency = max(self.concurrency / 2, self.min_concurrency)
+                    self._decreased = now
+            else:
+                self.concurrency = min(self.concurrency + 1 / self.concurrency, self.max_concurrency)
+
+            self._cond.notify_all()
+
+
+    # Private methods
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.burst)
+        self._updated = now
@@ -0,0 +1,75 @@
+import importlib
+import threading
+
+
+#: The built-in config types and the classes backing them up and restoring them
+CONFIG_TYPES = {
+    'archival_location': 'rubrik_config.archival_location:ArchivalLocationConfig',
+    'custom_report': 'rubrik_config.custom_report:CustomReportConfig',
+    'fileset_template': 'rubrik_config.fileset_template:FilesetTemplateConfig',
+    'replication_target': 'rubrik_config.replication_target:ReplicationTargetConfig',
+    'sla_domain': 'rubrik_config.sla_domain:SlaDomainConfig'
+}
+
+#: Entry point group through which other packages add config types. The name of
+#: an entry point is the config type, its value the `module:class` implementing it.
+ENTRY_POINT_GROUP = 'rubrik_config.config_types'
+
+_lock = threading.Lock()
+_classes = {}
+_plugins = None
+
+
+def config_types():
+    """Return the names of all the config types, built-in and added through entry points."""
+    return sorted(set(CONFIG_TYPES) | set(_plugin_types()))
+
+
+def config_class(config_type):
+    """Return the class of a config type, importing its module on first use.
+
+    Entry points are only looked up for config types that aren't built in.
+
+    Raises:
+        KeyError: If there is no such config type.
+    """
+    with _lock:
+        if config_type in _classes:
+            return _classes[config_type]
+
+    target = CONFIG_TYPES.get(config_type) or _plugin_types().get(config_type)
+    if not target:
+        raise KeyError(f"Unknown config type `{config_type}`")
+
+    module_name, class_name = target.split(':')
+    klass = getattr(importlib.import_module(module_name), class_name)
+
+    with _lock:
+        _classes[config_type] = klass
+
+    return klass
+
+
+# Private functions
+
+def _plugin_types():
+    global _plugins
+
+    with _lock:
+        if _plugins is None:
+            _plugins = { ep.name: ep.value for ep in _entry_points() if ep.name not in CONFIG_TYPES }
+
+        return _plugins
+
+
+def _entry_points():
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return []
+
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        return eps.select(group=ENTRY_POINT_GROUP)
+
+    return eps.get(ENTRY_POINT_GROUP, [])
@@ -2,70 +2,37 @@ import datetime
 import json
 import os
 
-import cli_ui
-import rubrik_cdm
-
 from rubrik_config.rubrik_config_base import RubrikConfigBase
-from rubrik_config.helpers import config_name, filter_fields, ask_multiline_string
-from urllib.parse import urlencode
+from rubrik_config.secret_store import SecretField
+from rubrik_config.transport import TransportError
+from rubrik_config.helpers import config_name, filter_fields
+
+
+SECRETS = [
+    SecretField('username', 'Username'),
+    SecretField('password', 'Password', hidden=True),
+    SecretField('caCerts', 'Trusted Root Certificate', optional=True, multiline=True),
+    SecretField('realm', 'Realm', optional=True)
+]
 
 
 class ReplicationTargetConfig(RubrikConfigBase):
 
-    def __init__(self, path, rubrik, logger):
-        super().__init__(path, rubrik, logger)
+    has_secrets = True
 
+    def __init__(self, path, rubrik, logger, **kwargs):
+        super().__init__(path, rubrik, logger, **kwargs)
 
-    def backup(self):
-        response = self.rubrik.get('internal', '/replication/target')
-        self.logger.info("%s Replication Targets found!" % response['total'])
 
-        replication_targets = response['data']
-        self._write(replication_targets, self.config_name, lambda x: x['targetClusterName'])
+    def backup(self):
+        total, replication_targets = self._paginate('internal', '/replication/target')
+        self.logger.info("%s Replication Targets found!" % total)
 
-        return response['total']
+        return self._write(replication_targets, self.config_name, lambda x: x['targetClusterName'])
 
 
     def restore(self, items):
-        jobs = []
-
-        for item in items:
-            self.logger.info("Restoring replication target `{}`".format(item['config']['targetClusterName']))
-
-            config = filter_fields(item['config'], [
-                'targetClusterAddress',
-                'targetGateway',
-                'sourceGateway',
-                'replicationSetup'
-            ])
-
-            username = cli_ui.ask_string('Username')
-            password = cli_ui.ask_password('Password')
-            ca_certs = ask_multiline_string('Trusted Root Certificate').strip()
-            realm = cli_ui.ask_string('Realm')
-
-            config['username'] = username
-            config['password'] = password
-            if ca_certs:
-                config['caCerts'] = ca_certs
-            if realm:
-                config['realm'] = realm
-            
-            try:
-                response = self.rubrik.post('internal', '/replication/target', config, timeout=120)
-                created_on = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S%z')
-                jobs += ({ 
-                    'id': response['id'], 
-                    'type': 'ADD_REPLICATION_TARGET', 
-                    'name': response['targetClusterName'], 
-                    'createdOn': created_on,
-                    'configType': self.config_name
-                }, )
-
-            except rubrik_cdm.exceptions.APICallException as e:
-                self.logger.error(e)
-
-        return jobs
+        return self._restore_items(items, self._restore_item)
 
 
     def status(self, job):
@@ -85,3 +52,65 @@ class ReplicationTargetConfig(RubrikConfigBase):
             ]
 
         return job_status
+
+
+    def secret_request(self, item):
+        name = item['config']['targetClusterName']
+
+        try:
+            action, _ = self._plan(name, self._target_config(item), updatable=False)
+            if 'skip' == action:
+                return None
+
+        except TransportError:
+            # Reported again when the item is restored
+            return None
+
+        return 'replication_target/{}'.format(name), SECRETS
+
+
+    # Private methods
+
+    def _restore_item(self, item):
+        config = self._target_config(item)
+
+        name = item['config']['targetClusterName']
+
+        # Credentials can't be compared, so targets that differ are only reported
+        action, _ = self._plan(name, config, updatable=False)
+        if 'skip' == action:
+            return None
+
+        self.logger.info("Restoring replication target `{}`".format(name))
+
+        secrets = self.secrets.get('replication_target/{}'.format(name), SECRETS)
+        config['username'] = secrets['username']
+        config['password'] = secrets['password']
+        if secrets['caCerts']:
+            config['caCerts'] = secrets['caCerts']
+        if secrets['realm']:
+            config['realm'] = secrets['realm']
+        
+        response = self.rubrik.post('internal', '/replication/target', config)
+        created_on = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S%z')
+        return { 
+            'id': response['id'], 
+            'type': 'ADD_REPLICATION_TARGET', 
+            'name': response['targetClusterName'], 
+            'createdOn': created_on,
+            'configType': self.config_name
+        }
+
+
+    def _target_config(self, item):
+        return filter_fields(item['config'], [
+            'targetClusterAddress',
+            'targetGateway',
+            'sourceGateway',
+            'replicationSetup'
+        ])
+
+
+    def _list_existing(self):
+        _, replication_targets = self._paginate('internal', '/replication/target')
+        return ((t['targetClusterName'], t) for t in replication_targets)
@@ -1,24 +1,57 @@
 import abc
-import json
-import os
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
 
 from rubrik_config import helpers
+from rubrik_config.cluster_context import ClusterContext
+from rubrik_config.secret_store import MissingSecretError, SecretStore
+from rubrik_config.serialization import canonical_json
+from rubrik_config.snapshot import DirectorySnapshotWriter, config_hash, content_hash
+from rubrik_config.transport import TransportError
 
 
 class RubrikConfigBase(abc.ABC):
 
-    def __init__(self, path, rubrik, logger):
+    #: Whether restoring items of this type needs secrets, see `secret_request`
+    has_secrets = False
+
+    def __init__(self, path, rubrik, logger, cluster=None, workers=1, page_size=500, snapshot=None,
+                 on_conflict='report', journal=None, secrets=None):
         self.path = path
         self.rubrik = rubrik
         self.logger = logger
+        self.workers = workers
+        self.page_size = page_size
+        self.snapshot = snapshot if snapshot else DirectorySnapshotWriter(path)
+        self.on_conflict = on_conflict
+        self.journal = journal
+
+        # Without a store resolved beforehand, secrets are asked for as items are restored
+        self.secrets = secrets if secrets else SecretStore()
+
+        self._existing = None
+        self._existing_lock = threading.Lock()
 
-        self.cluster_version = self.rubrik.cluster_version()
-        self.cluster_name = helpers.cluster_name(self.rubrik)
+        # Cluster metadata is shared across instances when a context is injected,
+        # and only fetched when it is actually used.
+        self.cluster = cluster if cluster else ClusterContext(rubrik)
 
         self.config_name = helpers.config_name(self)
         self.dependencies = set()
 
 
+    @property
+    def cluster_version(self):
+        return self.cluster.version
+
+
+    @property
+    def cluster_name(self):
+        return self.cluster.name
+
+
     @abc.abstractmethod
     def backup(self):
         """Backup all configuration items of this type.
@@ -34,7 +67,8 @@ class RubrikConfigBase(abc.ABC):
         """Restore the given configuration items.
 
         Args:
-            items ([str]): The configuration items to restore.
+            items (iterable): The configuration items to restore. They may be
+                              produced lazily.
 
         Returns:
             list: A list of jobs that have been initiated on the cluster as part
@@ -56,25 +90,214 @@ class RubrikConfigBase(abc.ABC):
         pass
 
 
+    def fingerprint(self):
+        """Return a hash of the objects of this type currently on the cluster.
+
+        The hash is computed over the canonical JSON of the list endpoints, so
+        it changes whenever an object is added, removed or modified.
+
+        Returns:
+            str: The SHA-256 hex digest of the objects.
+        """
+        objects = sorted(([name, obj] for name, obj in self._list_existing()), key=canonical_json)
+        return content_hash(objects)
+
+
+    def secret_request(self, item):
+        """Return the secrets needed to restore the given item.
+
+        Secrets aren't part of backups, e.g. the password of a replication
+        target. They are all resolved before the restore posts anything, so
+        it can run unattended. Only called when `has_secrets` is set.
+
+        Args:
+            item (dict): The configuration item to restore.
+
+        Returns:
+            tuple: The key of the target in the secret store and its list of
+                   `SecretField`, or None if the item needs no secrets.
+        """
+        return None
+
+
     # Private Methods
 
+    def _paginate(self, api_version, endpoint, params={}):
+        """Query a list endpoint page by page.
+
+        The first page is fetched right away. Every following page is requested
+        in the background while the items of the current one are consumed.
+
+        Args:
+            api_version (str): The API version of the endpoint.
+            endpoint (str): The list endpoint, without query string.
+            params (dict): Additional query parameters.
+
+        Returns:
+            tuple: The total number of items reported by the cluster and a
+                   generator over all the items.
+        """
+        params = dict(params, limit=self.page_size, offset=0)
+        first_page = self._get_page(api_version, endpoint, params)
+
+        return first_page.get('total', len(first_page['data'])), self._pages(api_version, endpoint, params, first_page)
+
+
+    def _pages(self, api_version, endpoint, params, page):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            while True:
+                has_more = page.get('hasMore', False) and len(page['data']) > 0
+
+                next_page = None
+                if has_more:
+                    params = dict(params, offset=params['offset'] + len(page['data']))
+                    next_page = executor.submit(self._get_page, api_version, endpoint, params)
+
+                yield from page['data']
+
+                if not next_page:
+                    break
+
+                page = next_page.result()
+
+
+    def _restore_items(self, items, restore_item):
+        """Restore items concurrently, bounded by the number of workers.
+
+        Items are pulled from `items` only as workers become available, so a
+        lazily produced sequence is never loaded entirely in memory.
+
+        An item whose API calls fail, or whose secrets are missing, is logged
+        and skipped, the restore goes on with the others. It is journaled as
+        failed, so a resumed restore tries it again.
+
+        Args:
+            items (iterable): The configuration items to restore.
+            restore_item (callable): Restores a single item and returns the
+                                     initiated job, or None. Raises
+                                     `TransportError` or `MissingSecretError`
+                                     when the item failed.
+
+        Returns:
+            list: The jobs initiated on the cluster.
+        """
+        if self.journal:
+            restore_item = self._journaled(restore_item)
+        restore_item = self._reported(restore_item)
+
+        jobs = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = collections.deque()
+            for item in items:
+                pending.append(executor.submit(restore_item, item))
+                if len(pending) >= 2 * self.workers:
+                    jobs.append(pending.popleft().result())
+
+            jobs += [f.result() for f in pending]
+
+        return [job for job in jobs if job]
+
+
+    def _journaled(self, restore_item):
+        def restore(item):
+            digest = config_hash(item)
+            self.journal.record('post', configType=self.config_name, hash=digest)
+            try:
+                job = restore_item(item)
+            except (TransportError, MissingSecretError) as e:
+                self.journal.record('failed', configType=self.config_name, hash=digest, error=str(e))
+                raise
+
+            self.journal.record('done', configType=self.config_name, hash=digest, job=job)
+
+            return job
+
+        return restore
+
+
+    def _reported(self, restore_item):
+        def restore(item):
+            try:
+                return restore_item(item)
+            except (TransportError, MissingSecretError) as e:
+                self.logger.error(e)
+                return None
+
+        return restore
+
+
+    def _list_existing(self):
+        """Return the objects of this type on the cluster as (name, object) pairs."""
+        return []
+
+
+    def _existing_detail(self, existing):
+        """Return the full configuration of an object returned by `_list_existing`."""
+        return existing
+
+
+    def _existing_items(self):
+        # Fetched once per instance, on first use, and shared by all the restore workers
+        with self._existing_lock:
+            if self._existing is None:
+                self._existing = dict(self._list_existing())
+
+        return self._existing
+
+
+    def _plan(self, name, config, updatable=True):
+        """Decide how to restore an item, given the objects already on the cluster.
+
+        An item is created when no object of the same name exists and skipped
+        when the existing object holds the same configuration. Otherwise it is
+        updated or only reported, depending on the `on_conflict` policy.
+
+        Args:
+            name (str): The name of the item.
+            config (dict): The configuration that would be sent to the cluster.
+            updatable (bool): Whether this type supports updating objects.
+
+        Returns:
+            tuple: One of 'create', 'update' or 'skip', and the existing object.
+        """
+        existing = self._existing_items().get(name)
+        if existing is None:
+            return 'create', None
+
+        detail = self._existing_detail(existing)
+        if helpers.filter_fields(detail, config.keys()) == config:
+            self.logger.info("`{}` already exists with the same configuration, skipping".format(name))
+            return 'skip', existing
+
+        if 'update' == self.on_conflict and updatable:
+            return 'update', existing
+
+        self.logger.warning("`{}` already exists with a different configuration, skipping".format(name))
+        return 'skip', existing
+
+
+    def _get_page(self, api_version, endpoint, params):
+        return self.rubrik.get(api_version, '{}?{}'.format(endpoint, urlencode(params)))
+
+
     def _write(self, content, content_type, name_fn=lambda x: x['name']):
-        if len(content) == 0:
-            return
+        count = 0
 
-        content_dir_name = content_type.split('.')[0]
-        path = f"{self.path}/{content_dir_name}"
-        os.makedirs(path, exist_ok=True)
-        
         for item in content:
-            filename = f"{path}/{helpers.secure_filename(name_fn(item))}.json"
-            with open(filename, 'w') as f:
-                file_content = { 
-                    'clusterName': self.cluster_name, 
-                    'clusterVersion': self.cluster_version, 
-                    'type': content_type,
-                    'config': item
-                }
-                f.write(json.dumps(file_content, indent=4, sort_keys=True))
-
-            self.logger.info("'%s' successfully saved to %s" % (name_fn(item), filename))
+            self._write_item(item, content_type, name_fn)
+            count += 1
+
+        return count
+
+
+    def _write_item(self, item, content_type, name_fn=lambda x: x['name']):
+        file_content = { 
+            'clusterName': self.cluster_name, 
+            'clusterVersion': self.cluster_version, 
+            'type': content_type,
+            'config': item
+        }
+        name = name_fn(item)
+        filename = self.snapshot.write(content_type, helpers.item_id(item, name), name, file_content)
+
+        self.logger.info("'%s' successfully saved to %s" % (name, filename))
@@ -1,38 +1,99 @@
-import importlib
-import inspect
 import json
 import logging
+import logging.handlers
 import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 import cli_ui
-import rubrik_cdm
 import toposort
-from toposort import toposort_flatten
 
-from rubrik_config import *
-from rubrik_config.helpers import ask_or_default, config_class, config_name, status_color
+from rubrik_config.cluster_context import ClusterContext
+from rubrik_config.catalog import Catalog, CatalogedSnapshotWriter
+from rubrik_config.diff import diff_snapshots
+from rubrik_config.instrumentation import CallRecorder
+from rubrik_config.journal import RestoreJournal
+from rubrik_config.rate_limiter import RateLimiter
+from rubrik_config.registry import config_class, config_types
+from rubrik_config.secret_store import SecretStore
+from rubrik_config.serialization import read_file, write_file
+from rubrik_config.snapshot import (ArchiveSnapshotWriter, ContentAddressedSnapshotWriter, DirectorySnapshotWriter,
+                                    IncrementalSnapshotReader, IncrementalSnapshotWriter, MemorySnapshot, ObjectStore,
+                                    SnapshotStaging, collect_garbage, convert_snapshot, get_snapshot_format,
+                                    is_legacy, open_snapshot, recover_conversion, remove_stale_staging)
+from rubrik_config.helpers import ask_or_default, status_color
+
+
+# Number of incremental backups in a row after which a full one is taken
+MAX_CHAIN_LENGTH = 30
 
 
 class Runner:
 
-    def __init__(self, path):
+    def __init__(self, path, workers=1, page_size=500, snapshot_format='directory', incremental=False,
+                 on_conflict='report', pool_size=None, rate_limit=100, retries=3, prometheus_path=None,
+                 secrets_file=None, secrets_helper=None, interactive=True, compact=False,
+                 max_chain_length=MAX_CHAIN_LENGTH):
         self.path = path
         self.restore_log_path = '.restore_log'
+        self.restore_journal_path = '.restore_journal'
+        self.workers = workers
+        self.page_size = page_size
+        self.snapshot_format = snapshot_format
+        self.incremental = incremental
+        self.max_chain_length = max_chain_length
+        self.on_conflict = on_conflict
+
+        # Every worker may hold a connection while the paginator prefetches the next page
+        self.pool_size = pool_size if pool_size else 2 * workers
+        self.default_pool_size = not pool_size
+        self.rate_limit = rate_limit
+        self.retries = retries
+        self.prometheus_path = prometheus_path
+        self.secrets_file = secrets_file
+        self.secrets_helper = secrets_helper
+        self.interactive = interactive
+        self.compact = compact
+
+        self.recorder = CallRecorder()
 
         self.rubrik = None
+        self.cluster = None
 
 
-    def backup(self):
+    def backup(self, incremental=None):
         if not self.rubrik:
             creds = self._read_credentials()
             self._connect(creds)
 
-        # Create the backup dir
-        backup_dir = os.path.join(
-            self.path, datetime.now().strftime("%Y-%m-%d_%H-%M-%S"))
-        os.makedirs(backup_dir, exist_ok=True)
+        catalog = Catalog(self.path)
+
+        # An incremental backup builds upon the latest existing snapshot, unless
+        # that one ends a chain of incremental backups as long as allowed
+        snapshots = catalog.snapshots()
+        parent = None
+        if (self.incremental if incremental is None else incremental) and snapshots:
+            parent_id = snapshots[-1]['snapshot_id']
+            parent_path = os.path.join(self.path, parent_id)
+            if not os.path.isdir(parent_path):
+                logging.info("Full backup, `%s` no longer exists" % parent_id)
+            else:
+                parent = open_snapshot(parent_path)
+                if isinstance(parent, IncrementalSnapshotReader) and parent.depth >= self.max_chain_length:
+                    logging.info("Full backup, `%s` ends a chain of %s incremental backups" % (
+                        parent_id, parent.depth))
+                    parent = None
+
+        # The backup is written to a staging dir, and only published once complete.
+        # The ones left by killed backups are removed first.
+        for snapshot_id in remove_stale_staging(self.path):
+            logging.info("Removed the staging directory of the interrupted backup `%s`" % snapshot_id)
+
+        store = ObjectStore(self.path) if 'cas' == self.snapshot_format else None
+        staging = SnapshotStaging(self.path, datetime.now().strftime("%Y-%m-%d_%H-%M-%S"), store)
+        backup_dir = staging.path
 
         # Log to file and store it together with the backup
         fh = logging.FileHandler(f"{backup_dir}/output.log")
@@ -40,87 +101,364 @@ class Runner:
         fh.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
         logging.getLogger().addHandler(fh)
 
-        for m in self._config_modules():
-            klass = config_class(m)
-            klass(backup_dir, self.rubrik, logging.getLogger()).backup()
-
-        # Remove the backup specific logger
-        logging.getLogger().removeHandler(fh)
+        try:
+            result = self._backup_snapshot(catalog, staging, parent)
+        finally:
+            # Remove the backup specific logger
+            logging.getLogger().removeHandler(fh)
+            fh.close()
+            catalog.close()
 
-        cli_ui.info('Backup log written to:', cli_ui.turquoise, f'{backup_dir}/output.log')
+            if not staging.committed:
+                staging.abort()
 
+        cli_ui.info('Backup log written to:', cli_ui.turquoise, f'{staging.final_path}/output.log')
 
-    def restore(self):
-        if not self.rubrik:
-            creds = self._read_credentials(ignore_stored=True)
-            self._connect(creds)
+        return result
 
-        # Find the backups/folders found under the given path
-        backups = [d for d in os.listdir(self.path)
-                   if os.path.isdir(os.path.join(self.path, d))]
 
-        # TODO: verify that the folders are really backup folders of this tool
+    def restore(self, config_type=None, name=None, resume=False, backup_id=None):
+        if resume and not os.path.isfile(self.restore_journal_path):
+            cli_ui.warning('No restore journal found!')
+            return
 
-        choice = cli_ui.ask_choice("Which backup to restore?", choices=backups)
-
-        logging.info('Restoring `{}`'.format(choice))
+        if not self.rubrik:
+            # Unattended restores read the credentials of the cluster like backups do
+            creds = self._read_credentials(ignore_stored=self.interactive)
+            self._connect(creds)
 
-        # Create a list of config types backed up in the chosen folder
-        config_types = [d for d in os.listdir(os.path.join(self.path, choice))
-                        if os.path.isdir(os.path.join(self.path, choice, d))]
+        # Find the backups recorded in the catalog of the given path
+        catalog = Catalog(self.path)
+        jobs = []
+
+        if resume:
+            # Continue with the planned items that weren't done, including the failed ones
+            state = RestoreJournal.replay(self.restore_journal_path)
+            choice = state['backupId']
+            # Journals written before items had IDs identify them by name
+            planned = { (p['configType'], p.get('itemId', p['name'])) for p in state['planned'] }
+            items = [i for i in catalog.items(snapshot_id=choice)
+                     if (i['config_type'], i['item_id']) in planned
+                     and (i['config_type'], i['hash']) not in state['done']]
+            jobs += [job for job in state['done'].values() if job]
+
+            journal = RestoreJournal(self.restore_journal_path, resume=True)
+            journal.record('resume', remaining=len(items))
+
+            logging.info('Resuming the restore of `{}`, {} items left, {} of which failed before'.format(
+                choice, len(items), len(state['failed'])))
+        else:
+            backups = [s['snapshot_id'] for s in catalog.snapshots()]
+            if backup_id and backup_id not in backups:
+                catalog.close()
+                cli_ui.warning('No backup `{}` found!'.format(backup_id))
+                return
+
+            choice = backup_id if backup_id else cli_ui.ask_choice("Which backup to restore?", choices=backups)
+            items = catalog.items(snapshot_id=choice, config_type=config_type, name=name)
+
+            if not items:
+                catalog.close()
+                cli_ui.warning('No items of `{}` match the given filters!'.format(choice))
+                return
+
+            journal = RestoreJournal(self.restore_journal_path)
+            journal.record('start', backupId=choice, filters={ 'type': config_type, 'name': name })
+            journal.record_many('planned', [
+                { 'configType': i['config_type'], 'itemId': i['item_id'], 'name': i['name'], 'hash': i['hash'] }
+                for i in items
+            ])
+
+            logging.info('Restoring `{}`'.format(choice))
+
+        catalog.close()
+
+        # Group the catalog entries of the chosen backup by config type. Only
+        # the entries matching the filters are loaded later on.
+        entries = {}
+        for item in items:
+            entries.setdefault(item['config_type'], []).append(item)
+
+        config_types = list(entries.keys())
 
         # Create a list of dependencies for each config type so we can make sure
         # we restore them in a dependencies first order
+        secrets = SecretStore(self.secrets_file, self.secrets_helper, self.interactive)
+        instances = {}
         deps = {}
         for c in config_types:
             klass = config_class(c)
-            instance = klass(self.path, self.rubrik, logging.getLogger())
-            deps[c] = instance.dependencies
+            instances[c] = klass(self.path, self.rubrik, logging.getLogger(), cluster=self.cluster,
+                                 workers=self.workers, page_size=self.page_size, on_conflict=self.on_conflict,
+                                 journal=journal, secrets=secrets)
+            deps[c] = instances[c].dependencies
+
+        # Every secret is resolved before the first item is posted, so a restore
+        # either has all it needs or fails without touching the cluster
+        if not self._resolve_secrets(instances, entries, secrets):
+            journal.close()
+            return
 
         try:
-            # Topologically sort the dependencies
-            sorted_config_types = toposort_flatten(deps)
-
-            # Execute restore in the sorted order
-            jobs = []
-            for c in sorted_config_types:
-                klass = config_class(c)
-                instance = klass(self.path, self.rubrik, logging.getLogger())
-
-                path = os.path.join(self.path, choice, config_name(instance))
-                items = []
-                for f in os.listdir(path):
-                    with open(os.path.join(path, f), 'r') as jf:
-                        items.append(json.load(jf))
-                
-                jobs += instance.restore(items)
+            # Topologically sort the dependencies into levels. The config types of
+            # a level only depend on the levels before it, so they are restored
+            # concurrently once the previous level is done.
+            for level in toposort.toposort(deps):
+                level = sorted(c for c in level if c in instances)
+
+                with ThreadPoolExecutor(max_workers=max(len(level), 1)) as executor:
+                    futures = [executor.submit(self._restore_config_type, instances[c], entries[c])
+                               for c in level]
+                    for future in futures:
+                        jobs += future.result()
 
             # Write the restore log
             self._write_restore_log(choice, jobs)
+            journal.record('finished')
+
+            self._log_api_stats()
+            self._write_api_report('restore')
             
         except toposort.CircularDependencyError as e:
             logging.critical(e)
 
+        finally:
+            journal.close()
+
+
+    def convert(self, snapshot_format):
+        catalog = Catalog(self.path)
+        snapshots = { s['snapshot_id']: s for s in catalog.snapshots() }
+
+        choice = cli_ui.ask_choice("Which backup to convert?", choices=list(snapshots.keys()))
+        path = os.path.join(self.path, choice)
+
+        # The catalog may be behind the snapshot if a conversion was interrupted
+        recover_conversion(path)
+        source_format = get_snapshot_format(path)
+        if source_format not in ('directory', 'archive'):
+            catalog.close()
+            cli_ui.warning('Only directory and archive backups can be converted!')
+            return
+
+        if source_format == snapshot_format:
+            # Unless the recovery completed a conversion, the catalog is up to date
+            if snapshots[choice]['format'] != source_format:
+                catalog.index_snapshot(choice, is_legacy(path))
+            catalog.close()
+            cli_ui.warning('`{}` is already in the {} format!'.format(choice, snapshot_format))
+            return
+
+        started = time.monotonic()
+        count = convert_snapshot(path, snapshot_format, pretty=not self.compact)
+        catalog.index_snapshot(choice, is_legacy(path))
+        catalog.close()
+
+        logging.info("%s items of `%s` converted to the %s format in %.2fs" % (
+            count, choice, snapshot_format, time.monotonic() - started))
+
+
+    def diff(self, snapshot_ids, live=False):
+        """Compare two backups, or a backup with the live configuration of the cluster.
+
+        Returns:
+            list: The differences, see `diff_snapshots`. None if the backups to
+                  compare aren't known.
+        """
+        expected = 1 if live else 2
+        if len(snapshot_ids) != expected:
+            cli_ui.error('Expected {} backup id(s) to compare, got {}'.format(expected, len(snapshot_ids)))
+            return None
+
+        catalog = Catalog(self.path)
+        known = { s['snapshot_id'] for s in catalog.snapshots() }
+        unknown = [s for s in snapshot_ids if s not in known]
+        if unknown:
+            catalog.close()
+            cli_ui.error('Unknown backup id(s): {}'.format(', '.join(unknown)))
+            return None
+
+        # The hashes come from the catalog, so unchanged items are never read.
+        # Items are matched by ID, or by display name when their IDs differ.
+        def catalog_hashes(snapshot_id):
+            hashes = {}
+            names = {}
+            for item in catalog.items(snapshot_id=snapshot_id):
+                hashes.setdefault(item['config_type'], {})[item['item_id']] = item['hash']
+                names.setdefault(item['config_type'], {})[item['item_id']] = item['name']
+            return hashes, names
+
+        old = open_snapshot(os.path.join(self.path, snapshot_ids[0]))
+        old_hashes, old_names = catalog_hashes(snapshot_ids[0])
+
+        if live:
+            new = self._live_snapshot()
+            new_hashes = new.hashes()
+            new_names = { c: { i: new.name(c, i) for i in hashes } for c, hashes in new_hashes.items() }
+            labels = (snapshot_ids[0], 'live')
+        else:
+            new = open_snapshot(os.path.join(self.path, snapshot_ids[1]))
+            new_hashes, new_names = catalog_hashes(snapshot_ids[1])
+            labels = tuple(snapshot_ids)
+
+        catalog.close()
+
+        started = time.monotonic()
+        differences = diff_snapshots(old_hashes, new_hashes, old.read, new.read, old_names, new_names)
+        elapsed = time.monotonic() - started
+
+        self._print_diff(labels, differences)
+        logging.info("%s items compared in %.2fs, %s differ" % (
+            sum(len(n) for n in new_hashes.values()), elapsed, len(differences)))
+
+        return differences
+
+
+    def list(self):
+        catalog = Catalog(self.path)
+        snapshots = catalog.snapshots()
+        catalog.close()
+
+        snapshot_rows = list(map(
+            lambda s: [
+                (cli_ui.bold, s['snapshot_id']),
+                (cli_ui.lightgray, s['cluster_name']),
+                (cli_ui.lightgray, s['cluster_version']),
+                (cli_ui.lightgray, s['format'] + (' (legacy)' if s['legacy'] else '')),
+                (cli_ui.lightgray, s['item_count'])],
+            snapshots
+        ))
+
+        cli_ui.info_table(snapshot_rows, headers=['Backup Id', 'Cluster', 'Version', 'Format', 'Items'])
+
+
+    def gc(self):
+        """Remove the blobs of the object store that no backup refers to anymore,
+        e.g. once backups were deleted."""
+        started = time.monotonic()
+        removed, size = collect_garbage(self.path)
+
+        logging.info("%s unreferenced objects removed, %s bytes freed in %.2fs" % (
+            removed, size, time.monotonic() - started))
+
+
+    def search(self, config_type=None, name=None):
+        catalog = Catalog(self.path)
+        items = catalog.items(config_type=config_type, name=name)
+        catalog.close()
 
-    def status(self):
+        item_rows = list(map(
+            lambda i: [
+                (cli_ui.lightgray, i['snapshot_id']),
+                (cli_ui.lightgray, i['cluster_name']),
+                (cli_ui.lightgray, i['config_type']),
+                (cli_ui.bold, i['name']),
+                (cli_ui.lightgray, i['hash'][:12]),
+                (cli_ui.lightgray, i['size'])],
+            items
+        ))
+
+        cli_ui.info_table(item_rows, headers=['Backup Id', 'Cluster', 'Type', 'Name', 'Hash', 'Size'])
+
+
+    def status(self, watch=False):
         if not (os.path.exists(self.restore_log_path) and os.path.isfile(self.restore_log_path)):
             cli_ui.warning('No restore log found!')
             sys.exit(0)  # FIXME: Don't exit, rather throw an exception
 
         restore_log = self._get_restore_log()
 
+        if watch:
+            # Imported on use, like the transport, to keep the start of rbkcb fast
+            from rubrik_config.status_watcher import WATCH_WORKERS, StatusWatcher
+
+            # Many jobs are polled at once, whatever the number of backup and restore workers
+            watch_workers = max(self.workers, WATCH_WORKERS)
+            if self.default_pool_size:
+                self.pool_size = max(self.pool_size, watch_workers)
+
         if not self.rubrik:
             creds = self._read_credentials(ignore_stored=True, presets={'address': restore_log['cluster']['ip']})
             self._connect(creds)
 
-        statuses = []
+        # One instance per config type is enough to query the status of all its jobs
+        instances = {}
+        for job in restore_log['jobs']:
+            config_type = job['configType']
+            if config_type not in instances:
+                klass = config_class(config_type)
+                instances[config_type] = klass(self.path, self.rubrik, logging.getLogger(), cluster=self.cluster)
+
+        if watch:
+            watcher = StatusWatcher(restore_log['jobs'], instances,
+                                    lambda statuses: self._print_status(restore_log, statuses),
+                                    workers=watch_workers)
+            watcher.run()
+            return
 
+        statuses = []
         for job in restore_log['jobs']:
-            klass = config_class(job['configType'])
-            status = klass(self.path, self.rubrik, logging.getLogger()).status(job)
+            status = instances[job['configType']].status(job)
             if status:
                 statuses.append(status)
 
+        self._print_status(restore_log, statuses)
+
+
+    # Private methods
+
+    def _live_snapshot(self):
+        if not self.rubrik:
+            creds = self._read_credentials()
+            self._connect(creds)
+
+        # Back up the config types into memory, so the live items are named and
+        # shaped exactly like the ones of a backup
+        snapshot = MemorySnapshot()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._backup_config_type, m, self.path, snapshot)
+                       for m in config_types()]
+
+            for future in futures:
+                result = future.result()
+                if result['error']:
+                    raise result['error']
+
+        return snapshot
+
+
+    def _print_diff(self, labels, differences):
+        symbols = {
+            'added': (cli_ui.green, '+'),
+            'removed': (cli_ui.red, '-'),
+            'changed': (cli_ui.yellow, '~')
+        }
+
+        cli_ui.info('\nComparing', cli_ui.turquoise, labels[0], cli_ui.reset, 'with', cli_ui.turquoise, labels[1],
+                    end='\n\n')
+
+        config_type = None
+        for d in differences:
+            if d['configType'] != config_type:
+                config_type = d['configType']
+                cli_ui.info(cli_ui.bold, config_type)
+
+            color, symbol = symbols[d['status']]
+            cli_ui.info(' ', color, symbol, cli_ui.reset, d['name'])
+            for operation, path, old, new in d['changes']:
+                color, symbol = symbols[operation]
+                if 'added' == operation:
+                    cli_ui.info('     ', color, symbol, cli_ui.reset, path, '=', json.dumps(new))
+                elif 'removed' == operation:
+                    cli_ui.info('     ', color, symbol, cli_ui.reset, path, '=', json.dumps(old))
+                else:
+                    cli_ui.info('     ', color, symbol, cli_ui.reset, path + ':', json.dumps(old), '->', json.dumps(new))
+
+        if not differences:
+            cli_ui.info(cli_ui.green, 'No differences')
+
+
+    def _print_status(self, restore_log, statuses):
         status_rows = list(map(
             lambda s: [
                 (status_color(s[0]), s[0]),
@@ -135,7 +473,165 @@ class Runner:
         cli_ui.info_table(status_rows, headers=['Status', 'Start time', 'End time', 'Type', 'Name'])
 
 
-    # Private methods
+    def _backup_snapshot(self, catalog, staging, parent):
+        backup_dir = staging.path
+
+        pretty = not self.compact
+        if staging.store:
+            snapshot = ContentAddressedSnapshotWriter(backup_dir, staging.store, pretty=pretty)
+        elif 'archive' == self.snapshot_format:
+            snapshot = ArchiveSnapshotWriter(backup_dir, pretty=pretty)
+        elif parent:
+            logging.info("Incremental backup based on `%s`" % os.path.basename(parent.path))
+            snapshot = IncrementalSnapshotWriter(backup_dir, parent, pretty=pretty)
+        else:
+            snapshot = DirectorySnapshotWriter(backup_dir, pretty=pretty)
+
+        snapshot_format = 'incremental' if parent else self.snapshot_format
+        snapshot = CatalogedSnapshotWriter(snapshot, catalog, snapshot_format, self.cluster, staging)
+
+        # Back up the config types concurrently. The log records of each type
+        # are buffered and replayed once the type is done so they stay grouped.
+        started = time.monotonic()
+        results = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._backup_config_type, m, backup_dir, snapshot)
+                       for m in config_types()]
+
+            for future in as_completed(futures):
+                result = future.result()
+                for record in result['records']:
+                    logging.getLogger().handle(record)
+                results.append(result)
+
+        snapshot.close()
+
+        elapsed = time.monotonic() - started
+
+        self._log_backup_summary(results, elapsed)
+        self._log_api_stats()
+        self._write_api_report('backup', backup_dir, staging.final_path)
+
+        # A backup missing config types is never published, so restores only see complete ones
+        errors = [r['error'] for r in results if r['error']]
+        if errors:
+            logging.error("Backup `%s` is incomplete and was discarded" % staging.snapshot_id)
+            raise errors[0]
+
+        snapshot.commit()
+
+        return {
+            'backupId': staging.snapshot_id,
+            'count': sum(r['count'] for r in results),
+            'elapsed': elapsed
+        }
+
+
+    def _backup_config_type(self, config_type, backup_dir, snapshot):
+        logger = logging.getLogger(f'rubrik_config.backup.{config_type}')
+        logger.propagate = False
+        buffer = logging.handlers.BufferingHandler(capacity=sys.maxsize)
+        logger.addHandler(buffer)
+
+        result = { 'configType': config_type, 'count': 0, 'error': None }
+        started = time.monotonic()
+        try:
+            klass = config_class(config_type)
+            instance = klass(backup_dir, self.rubrik, logger, cluster=self.cluster, workers=self.workers,
+                             page_size=self.page_size, snapshot=snapshot)
+            result['count'] = instance.backup()
+        except Exception as e:
+            logger.error("Backup of `%s` failed: %s" % (config_type, e))
+            result['error'] = e
+        finally:
+            logger.removeHandler(buffer)
+
+        result['elapsed'] = time.monotonic() - started
+        result['records'] = buffer.buffer
+
+        return result
+
+
+    def _log_backup_summary(self, results, elapsed):
+        results = sorted(results, key=lambda r: r['configType'])
+
+        for r in results:
+            logging.info("`%s`: %s items backed up in %.2fs%s" % (
+                r['configType'], r['count'], r['elapsed'], ' (FAILED)' if r['error'] else ''))
+        logging.info("Backup completed in %.2fs" % elapsed)
+
+        summary_rows = list(map(
+            lambda r: [
+                (cli_ui.red, 'FAILED') if r['error'] else (cli_ui.green, 'SUCCEEDED'),
+                (cli_ui.bold, r['configType']),
+                (cli_ui.lightgray, r['count']),
+                (cli_ui.lightgray, '%.2fs' % r['elapsed'])],
+            results
+        ))
+        summary_rows.append([
+            (cli_ui.lightgray, ''),
+            (cli_ui.bold, 'total'),
+            (cli_ui.lightgray, sum(r['count'] for r in results)),
+            (cli_ui.bold, '%.2fs' % elapsed)])
+
+        print()
+        cli_ui.info_table(summary_rows, headers=['Status', 'Type', 'Items', 'Wall time'])
+        print()
+
+
+    def _resolve_secrets(self, instances, entries, secrets):
+        requests = []
+        for config_type, instance in sorted(instances.items()):
+            if instance.has_secrets:
+                requests += filter(None, map(instance.secret_request, self._load_items(entries[config_type])))
+
+        if not requests:
+            return True
+
+        missing = secrets.resolve(requests)
+        if missing:
+            cli_ui.error('Missing secrets, nothing has been restored:', ', '.join(missing))
+            return False
+
+        logging.info("Secrets of %s targets resolved" % len(requests))
+        return True
+
+
+    def _restore_config_type(self, instance, entries):
+        return instance.restore(self._load_items(entries))
+
+
+    def _load_items(self, entries):
+        # Items are read through their snapshot, whatever its layout
+        snapshots = {}
+        for entry in entries:
+            snapshot_id = entry['snapshot_id']
+            if snapshot_id not in snapshots:
+                snapshots[snapshot_id] = open_snapshot(os.path.join(self.path, snapshot_id))
+
+            yield snapshots[snapshot_id].read(entry['config_type'], entry['item_id'])
+
+
+    def _log_api_stats(self):
+        # Only the transport keeps track of its calls
+        if not hasattr(self.rubrik, 'stats'):
+            return
+
+        stats = self.rubrik.stats()
+        logging.info("%s API calls, %s retried, %s failed, throttled %s times (concurrency limit %s)" % (
+            stats['requests'], stats['retries'], stats['errors'], stats['throttled'], stats['concurrency']))
+
+
+    def _write_api_report(self, action, report_dir=None, final_dir=None):
+        # A report written to a staging dir is logged with where it is once the backup is published
+        if report_dir:
+            report_path = os.path.join(report_dir, 'api_calls.json')
+            self.recorder.write_summary(report_path)
+            logging.info(f"API call report written to {os.path.join(final_dir or report_dir, 'api_calls.json')}")
+
+        if self.prometheus_path:
+            self.recorder.write_prometheus(self.prometheus_path, action, { 'cluster': self.cluster.name })
+
 
     def _read_credentials(self, path='~/.config/rubrik/cred.json', ignore_stored=False, presets={}):
         file_name = os.path.expanduser(path)
@@ -183,35 +679,36 @@ class Runner:
         return creds
 
 
-    def _connect(self, creds):
-        try:
-            print()
-            cli_ui.info('Connecting to Rubrik Cluster', cli_ui.turquoise, creds['address'])
-            rbk = rubrik_cdm.Connect(node_ip=creds['address'], api_token=creds['api_token'])
-            
-            cluster_version = rbk.cluster_version()
-            cli_ui.info('Cluster Version =', cli_ui.turquoise, cluster_version)
+    def connect(self, creds):
+        """Connect to the cluster of the given credentials.
 
-        except rubrik_cdm.exceptions.APICallException as e:
-            cli_ui.error(e)
-            sys.exit(1)  # FIXME: Replace with exception
-        
-        self.rubrik = rbk
+        Raises:
+            TransportError: If the cluster can't be reached.
+        """
+        # The HTTP stack is only imported by the commands talking to the cluster
+        from rubrik_config.transport import Transport
+
+        print()
+        cli_ui.info('Connecting to Rubrik Cluster', cli_ui.turquoise, creds['address'])
+        limiter = RateLimiter(rate=self.rate_limit, max_concurrency=self.pool_size)
+        rbk = Transport(creds['address'], creds['api_token'], pool_size=self.pool_size, limiter=limiter,
+                        retries=self.retries, recorder=self.recorder)
+        cluster = ClusterContext(rbk)
 
+        cli_ui.info('Cluster Version =', cli_ui.turquoise, cluster.version)
 
-    def _config_modules(self):
-        all_config_modules = inspect.getmembers(
-            importlib.import_module('rubrik_config'),
-            lambda m: inspect.ismodule(m)
-        )
+        self.rubrik = rbk
+        self.cluster = cluster
 
-        config_modules = []
-        for module in all_config_modules:
-            classes = inspect.getmembers(importlib.import_module(module[1].__name__), inspect.isclass)
-            if len(classes) > 1 and 'RubrikConfigBase' in list(map(lambda c: c[0], classes)):
-                config_modules.append(module[0])
 
-        return config_modules
+    def _connect(self, creds):
+        from rubrik_config.transport import TransportError
+
+        try:
+            self.connect(creds)
+        except TransportError as e:
+            cli_ui.error(e)
+            sys.exit(1)  # FIXME: Replace with exception
 
 
     def _write_restore_log(self, backupId, jobs):
@@ -219,16 +716,14 @@ class Runner:
             'backupId': backupId,
             'createdOn': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S%z'),
             'cluster': {
-                'name': self.rubrik.get('v1', '/cluster/me')['name'],
-                'ip': self.rubrik.cluster_node_ip()[0],
-                'version': self.rubrik.cluster_version()
+                'name': self.cluster.name,
+                'ip': self.cluster.node_ips[0],
+                'version': self.cluster.version
             },
             'jobs': jobs
         }
-        with open(self.restore_log_path, 'w') as f:
-            f.write(json.dumps(job_log, indent=4, sort_keys=False))
+        write_file(self.restore_log_path, job_log)
 
 
     def _get_restore_log(self):
-        f = open(self.restore_log_path, 'r')
-        return json.load(f)
+        return read_file(self.restore_log_path)
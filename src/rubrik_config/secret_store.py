@@ -0,0 +1,191 @@
+import fnmatch
+import logging
+import os
+import re
+import shlex
+import subprocess
+import threading
+
+import cli_ui
+
+from rubrik_config.helpers import ask_multiline_string
+from rubrik_config.serialization import loads
+
+
+class MissingSecretError(KeyError):
+    """A required secret of a restored item was not found."""
+
+    def __str__(self):
+        return self.args[0]
+
+
+class SecretField:
+    """A secret of a restored item.
+
+    Args:
+        name (str): Name of the field of the posted config holding the secret.
+        label (str): Label of the prompt asking for the secret.
+        optional (bool): Whether the secret may be left blank.
+        hidden (bool): Whether the secret is typed without echo.
+        multiline (bool): Whether the secret spans several lines, like a certificate.
+    """
+
+    def __init__(self, name, label, optional=False, hidden=False, multiline=False):
+        self.name = name
+        self.label = label
+        self.optional = optional
+        self.hidden = hidden
+        self.multiline = multiline
+
+
+class SecretStore:
+    """Secrets needed by a restore, resolved before anything is posted to the cluster.
+
+    Secrets are grouped under a key per target, e.g. `replication_target/<name>`.
+    Every field is looked up, in order, in:
+
+    1. The secrets file, a YAML or JSON mapping of keys to their fields. Keys
+       may be glob patterns like `replication_target/*`; an exact key wins.
+    2. The environment variable `RBKCB_SECRET_<KEY>_<FIELD>`, with every
+       character of key and field that isn't alphanumeric replaced by `_`.
+    3. The credential helper, a command run as `<command> get <key>` that
+       prints a JSON object of the fields it knows.
+    4. A prompt, unless the store isn't interactive.
+
+    Args:
+        secrets_file (str): Path of the secrets file.
+        helper (str): Command line of the credential helper.
+        interactive (bool): Whether to prompt for the secrets no source has.
+    """
+
+    def __init__(self, secrets_file=None, helper=None, interactive=True):
+        self.secrets_file = secrets_file
+        self.helper = helper
+        self.interactive = interactive
+
+        self._lock = threading.Lock()
+        self._file_secrets = None
+        self._resolved = {}
+
+
+    def resolve(self, requests):
+        """Resolve the secrets of many targets at once.
+
+        Args:
+            requests (list): `(key, fields)` tuples, as returned by `secret_request`.
+
+        Returns:
+            list: The `<key>: <field>` names of the required secrets that were not found.
+        """
+        missing = []
+        for key, fields in requests:
+            values = self.get(key, fields, required=False)
+            missing += [f"{key}: {f.name}" for f in fields if values.get(f.name) is None]
+
+        return missing
+
+
+    def get(self, key, fields, required=True):
+        """Return the secrets of a target, resolving them on first use.
+
+        Returns:
+            dict: The value of every field. Optional fields that were not found
+                  are blank, required ones None.
+
+        Raises:
+            MissingSecretError: If `required` and a required secret was not found.
+        """
+        with self._lock:
+            if key not in self._resolved:
+                self._resolved[key] = self._resolve(key, fields)
+            values = self._resolved[key]
+
+        missing = [f.name for f in fields if values.get(f.name) is None]
+        if required and missing:
+            raise MissingSecretError(f"No {', '.join(missing)} secret for `{key}`")
+
+        return values
+
+
+    # Private methods
+
+    def _resolve(self, key, fields):
+        sources = [self._from_file(key), self._from_environment(key, fields)]
+
+        values = {}
+        prompted = False
+        for field in fields:
+            value = next((s[field.name] for s in sources if s.get(field.name) is not None), None)
+
+            if value is None and self.helper:
+                if len(sources) < 3:
+                    sources.append(self._from_helper(key))
+                value = sources[2].get(field.name)
+
+            if value is None and self.interactive:
+                if not prompted:
+                    cli_ui.info(cli_ui.bold, 'Secrets of', cli_ui.turquoise, key)
+                    prompted = True
+                value = self._prompt(field)
+
+            if value is None and field.optional:
+                value = ''
+
+            values[field.name] = value.strip() if field.multiline and value else value
+
+        return values
+
+
+    def _from_file(self, key):
+        if not self.secrets_file:
+            return {}
+
+        if self._file_secrets is None:
+            import yaml
+
+            with open(os.path.expanduser(self.secrets_file), 'r') as f:
+                self._file_secrets = yaml.safe_load(f) or {}
+
+        if key in self._file_secrets:
+            return self._file_secrets[key] or {}
+
+        for pattern, secrets in self._file_secrets.items():
+            if fnmatch.fnmatchcase(key, pattern):
+                return secrets or {}
+
+        return {}
+
+
+    def _from_environment(self, key, fields):
+        prefix = 'RBKCB_SECRET_' + re.sub('[^A-Za-z0-9]', '_', key).upper()
+
+        values = {}
+        for field in fields:
+            name = f"{prefix}_{re.sub('[^A-Za-z0-9]', '_', field.name).upper()}"
+            if name in os.environ:
+                values[field.name] = os.environ[name]
+
+        return values
+
+
+    def _from_helper(self, key):
+        result = subprocess.run(shlex.split(self.helper) + ['get', key],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if 0 != result.returncode:
+            logging.debug("The credential helper has no secrets for `%s`: %s" % (key, result.stderr.strip()))
+            return {}
+
+        try:
+            return loads(result.stdout) or {}
+        except ValueError:
+            logging.warning("The credential helper returned invalid JSON for `%s`" % key)
+            return {}
+
+
+    def _prompt(self, field):
+        if field.multiline:
+            return ask_multiline_string(field.label)
+        if field.hidden:
+            return cli_ui.ask_password(field.label)
+
+        return cli_ui.ask_string(field.label)
@@ -0,0 +1,89 @@
+"""JSON serialization of items, manifests, journals and logs.
+
+Everything written by `rbkcb` goes through this module, in one of two forms:
+
+* The canonical form: keys sorted, no whitespace, non-ASCII characters
+  escaped. It is what items are hashed and stored in object stores and
+  archives as, so it must never change.
+* The pretty form: keys sorted and indented by two spaces, for the files
+  humans read, like the items of directory snapshots.
+
+`orjson <https://github.com/ijl/orjson>`_ is used when installed, with the
+standard library as fallback. Both produce the same canonical bytes: when
+orjson's output could differ, i.e. with non-ASCII text, the DEL character,
+floats, non-string keys or integers beyond 64 bits, the standard library
+serializes the content instead. The environment variable
+`RBKCB_JSON_BACKEND=json` forces the standard library.
+"""
+
+import json
+import os
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+#: Name of the JSON library in use, `orjson` or `json`
+BACKEND = 'orjson' if orjson and 'json' != os.environ.get('RBKCB_JSON_BACKEND') else 'json'
+
+# A float, which orjson may write differently from the standard library, e.g. `1e16` for `1e+16`
+_FLOAT = re.compile(rb'[:,\[]-?[0-9]+[.e]')
+
+
+def canonical_json(content):
+    """Serialize content to its canonical bytes, the form it is hashed and stored as.
+
+    >>> canonical_json({'b': [1, 2.5], 'a': 'é'})
+    b'{"a":"\\\\u00e9","b":[1,2.5]}'
+    """
+    if 'orjson' == BACKEND:
+        try:
+            data = orjson.dumps(content, option=orjson.OPT_SORT_KEYS)
+            # orjson writes DEL as is, the standard library escapes it
+            if data.isascii() and b'\x7f' not in data and not _FLOAT.search(data):
+                return data
+        except TypeError:
+            pass
+
+    return json.dumps(content, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def dumps(content, pretty=False):
+    """Serialize content to bytes, in the canonical or the pretty form."""
+    if not pretty:
+        return canonical_json(content)
+
+    if 'orjson' == BACKEND:
+        try:
+            return orjson.dumps(content, option=orjson.OPT_SORT_KEYS | orjson.OPT_INDENT_2)
+        except TypeError:
+            pass
+
+    return json.dumps(content, sort_keys=True, indent=2, ensure_ascii=False).encode('utf-8')
+
+
+def loads(data):
+    """Parse JSON from bytes or a string."""
+    if 'orjson' == BACKEND:
+        try:
+            return orjson.loads(data)
+        except ValueError:
+            # E.g. NaN, which the standard library parses
+            pass
+
+    return json.loads(data)
+
+
+def read_file(path):
+    """Parse the JSON file at the given path."""
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def write_file(path, content, pretty=True):
+    """Write content to the given path as JSON, in the pretty form unless told otherwise."""
+    with open(path, 'wb') as f:
+        f.write(dumps(content, pretty))
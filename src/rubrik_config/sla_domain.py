@@ -2,77 +2,33 @@ import datetime
 import json
 import os
 
-import rubrik_cdm
 from rubrik_config.rubrik_config_base import RubrikConfigBase
 from rubrik_config.helpers import filter_fields, config_name
-from urllib.parse import urlencode
 
 
 class SlaDomainConfig(RubrikConfigBase):
 
-    def __init__(self, path, rubrik, logger):
-        super().__init__(path, rubrik, logger)
+    def __init__(self, path, rubrik, logger, **kwargs):
+        super().__init__(path, rubrik, logger, **kwargs)
 
         self.dependencies = { 'archival_location', 'replication_target' }
 
 
     def backup(self):
-        response = self.rubrik.get('v2', '/sla_domain?{}'.format(urlencode({'primary_cluster_id': 'local'})))
-        self.logger.info("%s SLA domains found!" % response['total'])
+        total, sla_domains = self._paginate('v2', '/sla_domain', {'primary_cluster_id': 'local'})
+        self.logger.info("%s SLA domains found!" % total)
 
-        sla_domains = response['data']
-
-        self._write(sla_domains, self.config_name)
-
-        return response['total']
+        return self._write(sla_domains, self.config_name)
 
 
     def restore(self, items):
-        jobs = []
-
-        for item in items:
-            config = filter_fields(item['config'], [
-                'name',
-                'frequencies',
-                'allowedBackupWindows',
-                'logConfig',
-                'firstFullAllowedBackupWindows',
-                'localRetentionLimit',
-                'isRetentionLocked'
-                'archivalSpecs',
-                'replicationSpecs',
-                'showAdvancedUi',
-                'advancedUiConfig'
-            ])
-
-            # FIXME: Restore archivalSpecs and replicationSpecs correctly!
-            
-            self.logger.info("Restoring sla domain `{}`".format(config['name']))
-            
-            try:
-                response = self.rubrik.post('v2', '/sla_domain', config)
-                created_on = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S%z')
-                jobs += ({ 
-                    'id': response['id'], 
-                    'type': 'CREATE_SLA_DOMAIN', 
-                    'name': config['name'], 
-                    'createdOn': created_on,
-                    'configType': self.config_name
-                }, )
-
-                # TODO: How is uiColor and isDefault restored?
-                # TODO: If isPaused is true, execute a pause request after creation
-
-            except rubrik_cdm.exceptions.APICallException as e:
-                self.logger.error(e)
-
-        return jobs
+        return self._restore_items(items, self._restore_item)
 
 
     def status(self, job):
         job_status = None
 
-        if 'CREATE_SLA_DOMAIN' == job['type']:
+        if job['type'] in ('CREATE_SLA_DOMAIN', 'UPDATE_SLA_DOMAIN'):
             status = 'SUCCEEDED'
             start_time = job['createdOn']
             end_time = job['createdOn']
@@ -86,3 +42,52 @@ class SlaDomainConfig(RubrikConfigBase):
             ]
 
         return job_status
+
+
+    # Private methods
+
+    def _restore_item(self, item):
+        config = filter_fields(item['config'], [
+            'name',
+            'frequencies',
+            'allowedBackupWindows',
+            'logConfig',
+            'firstFullAllowedBackupWindows',
+            'localRetentionLimit',
+            'isRetentionLocked'
+            'archivalSpecs',
+            'replicationSpecs',
+            'showAdvancedUi',
+            'advancedUiConfig'
+        ])
+
+        # FIXME: Restore archivalSpecs and replicationSpecs correctly!
+        
+        self.logger.info("Restoring sla domain `{}`".format(config['name']))
+        
+        action, existing = self._plan(config['name'], config)
+        if 'skip' == action:
+            return None
+
+        if 'update' == action:
+            self.rubrik.patch('v2', '/sla_domain/{}'.format(existing['id']), config)
+            job_id = existing['id']
+        else:
+            job_id = self.rubrik.post('v2', '/sla_domain', config)['id']
+        created_on = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S%z')
+
+        # TODO: How is uiColor and isDefault restored?
+        # TODO: If isPaused is true, execute a pause request after creation
+
+        return { 
+            'id': job_id, 
+            'type': 'UPDATE_SLA_DOMAIN' if 'update' == action else 'CREATE_SLA_DOMAIN', 
+            'name': config['name'], 
+            'createdOn': created_on,
+            'configType': self.config_name
+        }
+
+
+    def _list_existing(self):
+        _, sla_domains = self._paginate('v2', '/sla_domain', {'primary_cluster_id': 'local'})
+        return ((s['name'], s) for s in sla_domains)
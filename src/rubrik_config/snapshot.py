@@ -0,0 +1,1107 @@
+import fcntl
+import functools
+import hashlib
+import itertools
+import os
+import shutil
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from rubrik_config.helpers import secure_filename
+from rubrik_config.registry import config_types
+from rubrik_config.serialization import canonical_json, dumps, loads, read_file, write_file
+
+
+MANIFEST_NAME = 'manifest.json'
+OBJECTS_DIR_NAME = '.objects'
+ARCHIVE_NAME = 'items.jsonl.gz'
+STAGING_DIR_NAME = '.staging'
+COMPLETE_NAME = 'COMPLETE'
+
+# Number of files synced at once when a snapshot is committed. Syncing is
+# mostly waiting on the storage, e.g. a COMMIT round trip per file on NFS.
+SYNC_WORKERS = 16
+
+# Age, in seconds, below which blobs no snapshot refers to are kept by the
+# garbage collection, as they may belong to a backup still running
+GC_GRACE_PERIOD = 24 * 3600
+
+# Uncompressed size of the independently compressed blocks of an archive
+ARCHIVE_BLOCK_SIZE = 256 * 1024
+
+# zlib window bits producing and reading gzip members
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def content_hash(content):
+    return hashlib.sha256(canonical_json(content)).hexdigest()
+
+
+def config_hash(content):
+    """Return the hash of an item recorded in manifests and the catalog: the
+    hash of its `config` alone, so the same configuration backed up from
+    another cluster or version of CDM has the same hash."""
+    return content_hash(content['config'])
+
+
+def content_dir_name(content_type):
+    return content_type.split('.')[0]
+
+
+def item_filename(item_id):
+    """Return the name of the file of an item, without extension.
+
+    IDs that aren't safe file names are sanitized and suffixed with their hash,
+    so distinct IDs never share a file, even when sanitizing strips them entirely.
+
+    >>> item_filename('Gold')
+    'Gold'
+    >>> item_filename('SlaDomain:::1')
+    'SlaDomain1-7eb53beb04b4'
+    """
+    filename = secure_filename(item_id)
+    if filename != item_id:
+        digest = hashlib.sha256(item_id.encode('utf-8')).hexdigest()[:12]
+        filename = f"{filename}-{digest}" if filename else digest
+
+    return filename
+
+
+def index_entry(name, file=None, snapshot=None, envelope=None):
+    """Entry of an item in the index of a manifest: its display name, its file
+    relative to the snapshot if it was written to the snapshot directory, for
+    the unchanged items of an incremental snapshot the ID of the snapshot
+    holding their content, and for content addressed snapshots the fields of
+    the item besides its `config`, which alone is stored as a blob."""
+    entry = { 'name': name }
+    if file:
+        entry['file'] = file
+    if snapshot:
+        entry['snapshot'] = snapshot
+    if envelope:
+        entry['envelope'] = envelope
+
+    return entry
+
+
+def write_manifest(path, manifest, pretty=True):
+    """Write the manifest of a snapshot, replacing any previous one at once."""
+    os.makedirs(path, exist_ok=True)
+    tmp_path = os.path.join(path, f"{MANIFEST_NAME}.tmp")
+    write_file(tmp_path, manifest, pretty)
+    os.replace(tmp_path, os.path.join(path, MANIFEST_NAME))
+
+
+def archive_location(archive_path, config_type, item_id):
+    """Location of an item in an archive, in the form `<archive path>#<config type>/<ID>`."""
+    return f"{archive_path}#{config_type}/{item_id}"
+
+
+def list_snapshots(root):
+    """Return the IDs of the complete snapshots under a backup root, oldest first."""
+    if not os.path.isdir(root):
+        return []
+
+    return sorted(d for d in os.listdir(root)
+                  if not d.startswith('.') and is_complete(os.path.join(root, d)))
+
+
+def is_complete(path):
+    """Whether the directory holds a snapshot that was entirely written and synced."""
+    return os.path.isfile(os.path.join(path, COMPLETE_NAME))
+
+
+def write_complete_marker(path, snapshot_id, files):
+    """Mark the snapshot in the given directory as entirely written and synced.
+
+    Args:
+        path (str): The snapshot directory.
+        snapshot_id (str): The ID of the snapshot.
+        files (int): The number of files of the snapshot.
+    """
+    marker = {
+        'snapshotId': snapshot_id,
+        'createdOn': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'files': files
+    }
+    tmp_path = os.path.join(path, f"{COMPLETE_NAME}.tmp")
+    write_file(tmp_path, marker)
+    sync_paths([tmp_path])
+    os.replace(tmp_path, os.path.join(path, COMPLETE_NAME))
+    sync_paths([path])
+
+
+def list_legacy_snapshots(root):
+    """Return the IDs of the snapshots under a backup root that were taken
+    before snapshots had a manifest and a completion marker, oldest first."""
+    if not os.path.isdir(root):
+        return []
+
+    return sorted(d for d in os.listdir(root)
+                  if not d.startswith('.') and is_legacy(os.path.join(root, d)))
+
+
+def is_legacy(path):
+    """Whether the directory holds a snapshot of the original layout: a
+    directory of JSON files per config type, without manifest nor marker.
+    Other directories, e.g. the backup roots of the clusters of a fleet, hold
+    no directory named after a config type."""
+    if not os.path.isdir(path) or is_complete(path) or os.path.exists(os.path.join(path, MANIFEST_NAME)):
+        return False
+
+    return any(f.endswith('.json')
+               for d in config_types() if os.path.isdir(os.path.join(path, d))
+               for f in os.listdir(os.path.join(path, d)))
+
+
+def sync_paths(paths):
+    """Flush files and directories to stable storage, many at once."""
+    def sync(path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    with ThreadPoolExecutor(max_workers=SYNC_WORKERS) as executor:
+        list(executor.map(sync, paths))
+
+
+def open_snapshot(path):
+    """Return a reader for the snapshot stored in the given directory."""
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    if not os.path.isfile(manifest_path):
+        return DirectorySnapshotReader(path)
+
+    manifest = read_file(manifest_path)
+
+    root = os.path.dirname(path)
+    if 'incremental' == manifest['format']:
+        return IncrementalSnapshotReader(path, manifest)
+    if 'archive' == manifest['format']:
+        return ArchiveSnapshotReader(path, manifest)
+    if 'directory' == manifest['format']:
+        return DirectorySnapshotReader(path, manifest)
+
+    return ContentAddressedSnapshotReader(path, manifest, ObjectStore(root))
+
+
+def get_snapshot_format(path):
+    """Return the layout of the snapshot in the given directory, as recorded in
+    its manifest. Snapshots without a manifest are directory snapshots."""
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    if not os.path.isfile(manifest_path):
+        return 'directory'
+
+    return read_file(manifest_path)['format']
+
+
+def convert_snapshot(path, snapshot_format, pretty=True):
+    """Rewrite the snapshot in the given directory to the directory or archive
+    layout. Files that aren't items, like the backup log, are kept.
+
+    The new layout is written to `<root>/.staging/<snapshot id>.convert`, along
+    with a copy of the other files, and swapped with the snapshot directory
+    once complete. An interrupted conversion thus leaves either the source or
+    the converted snapshot, and can be run again. A snapshot already in the
+    requested format is left as is.
+
+    Returns:
+        int: The number of converted items, 0 if the snapshot already was in the format.
+    """
+    recover_conversion(path)
+    root, snapshot_id, work_path, old_path = _conversion_paths(path)
+
+    if snapshot_format == get_snapshot_format(path):
+        return 0
+
+    source = open_snapshot(path)
+    if type(source) not in (DirectorySnapshotReader, ArchiveSnapshotReader):
+        raise ValueError('Only directory and archive snapshots can be converted')
+
+    if 'archive' == snapshot_format:
+        writer = ArchiveSnapshotWriter(work_path, pretty=pretty)
+    else:
+        writer = DirectorySnapshotWriter(work_path, pretty=pretty)
+
+    count = 0
+    for config_type in source.config_types():
+        for item_id in source.ids(config_type):
+            content = source.read(config_type, item_id)
+            writer.write(content['type'], item_id, source.name(config_type, item_id), content)
+            count += 1
+
+    writer.close()
+
+    # Everything but the items of the source layout, e.g. the backup log
+    layout = {MANIFEST_NAME, f"{MANIFEST_NAME}.tmp", COMPLETE_NAME, f"{COMPLETE_NAME}.tmp"}
+    if isinstance(source, ArchiveSnapshotReader):
+        layout.add(os.path.basename(source.archive_path))
+    else:
+        layout.update(source.config_types())
+
+    for name in os.listdir(path):
+        if name not in layout and os.path.isfile(os.path.join(path, name)):
+            shutil.copy2(os.path.join(path, name), os.path.join(work_path, name))
+
+    files = []
+    dirs = []
+    for dirpath, _, filenames in os.walk(work_path):
+        dirs.append(dirpath)
+        files += [os.path.join(dirpath, f) for f in filenames]
+
+    sync_paths(files)
+    sync_paths(dirs)
+
+    # Snapshots of the original layout become complete ones once converted
+    write_complete_marker(work_path, snapshot_id, len(files))
+
+    os.rename(path, old_path)
+    os.rename(work_path, path)
+    sync_paths([os.path.dirname(work_path), root])
+    shutil.rmtree(old_path)
+
+    return count
+
+
+def recover_conversion(path):
+    """Finish or roll back a conversion of the snapshot in the given directory
+    interrupted by a previous run. The converted snapshot is only moved in
+    place once complete, so it is kept if the source was already moved away."""
+    _, _, work_path, old_path = _conversion_paths(path)
+    if not os.path.exists(path):
+        if os.path.exists(work_path):
+            os.rename(work_path, path)
+        elif os.path.exists(old_path):
+            os.rename(old_path, path)
+
+    shutil.rmtree(work_path, ignore_errors=True)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def _conversion_paths(path):
+    # The snapshot root and ID, and where the converted and source layouts are moved
+    root, snapshot_id = os.path.split(os.path.normpath(path))
+    staging_path = os.path.join(root, STAGING_DIR_NAME)
+
+    return (root, snapshot_id,
+            os.path.join(staging_path, f"{snapshot_id}.convert"),
+            os.path.join(staging_path, f"{snapshot_id}.old"))
+
+
+class SnapshotStaging:
+    """Directory a snapshot is written to before it is published.
+
+    A snapshot is staged in `<root>/.staging/<snapshot id>`, which neither the
+    catalog nor `list_snapshots` look at. Committing it syncs all its files in
+    a single pass, writes the completion marker and renames the directory into
+    the backup root, so a snapshot is either complete or absent.
+
+    The snapshot ID is reserved when the staging directory is created. If a
+    snapshot of the same ID is already published or staged, e.g. another
+    backup started within the same second, a `-01`, `-02`... suffix is added.
+    The staging directory is locked until the snapshot is committed or
+    aborted, so `remove_stale_staging` only removes the ones of killed backups.
+
+    Args:
+        root (str): The backup root.
+        snapshot_id (str): The preferred name of the published snapshot directory.
+        store (ObjectStore): The object store the snapshot adds blobs to, if any.
+    """
+
+    def __init__(self, root, snapshot_id, store=None):
+        self.root = root
+        self.store = store
+        self.committed = False
+        self._lock_fd = None
+
+        os.makedirs(os.path.join(root, STAGING_DIR_NAME), exist_ok=True)
+
+        for n in itertools.count():
+            self.snapshot_id = f"{snapshot_id}-{n:02d}" if n else snapshot_id
+            self.path = os.path.join(root, STAGING_DIR_NAME, self.snapshot_id)
+            self.final_path = os.path.join(root, self.snapshot_id)
+
+            if os.path.exists(self.final_path):
+                continue
+            try:
+                os.mkdir(self.path)
+            except FileExistsError:
+                continue
+
+            # Another backup may have removed the directory as stale before it was locked
+            self._lock_fd = _lock_directory(self.path)
+            if self._lock_fd is None or not os.path.isdir(self.path):
+                self._unlock()
+                continue
+
+            # Another backup may have published the same ID since it was checked
+            if not os.path.exists(self.final_path):
+                break
+            os.rmdir(self.path)
+            self._unlock()
+
+
+    def commit(self):
+        files = []
+        dirs = []
+        for dirpath, _, filenames in os.walk(self.path):
+            dirs.append(dirpath)
+            files += [os.path.join(dirpath, f) for f in filenames]
+
+        if self.store:
+            dirs += self.store.flush()
+
+        # Files first, then the directories holding their entries
+        sync_paths(files)
+        sync_paths(dirs)
+
+        write_complete_marker(self.path, self.snapshot_id, len(files))
+
+        # rename() would silently replace an empty directory of the same name
+        if os.path.exists(self.final_path):
+            raise FileExistsError(f"Snapshot `{self.snapshot_id}` already exists")
+
+        os.rename(self.path, self.final_path)
+        self.committed = True
+        sync_paths([os.path.dirname(self.path), self.root])
+        self._unlock()
+
+
+    def abort(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        self._unlock()
+
+
+    def final_location(self, location):
+        """Return where a location within the staging directory is once committed."""
+        if location.startswith(self.path + os.sep):
+            return self.final_path + location[len(self.path):]
+
+        return location
+
+
+    # Private methods
+
+    def _unlock(self):
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+
+def remove_stale_staging(root):
+    """Remove the staging directories left by killed backups, i.e. the ones no
+    running backup holds the lock of. The directories of conversions are left
+    to `recover_conversion`.
+
+    Returns:
+        list: The IDs of the snapshots whose staging directory was removed.
+    """
+    staging_path = os.path.join(root, STAGING_DIR_NAME)
+    if not os.path.isdir(staging_path):
+        return []
+
+    removed = []
+    for name in sorted(os.listdir(staging_path)):
+        path = os.path.join(staging_path, name)
+        if name.endswith(('.convert', '.old')) or not os.path.isdir(path):
+            continue
+
+        fd = _lock_directory(path)
+        if fd is None:
+            continue
+        try:
+            shutil.rmtree(path, ignore_errors=True)
+        finally:
+            os.close(fd)
+        removed.append(name)
+
+    return removed
+
+
+def _lock_directory(path):
+    # A file descriptor holding an exclusive lock on the directory, None if
+    # the directory is gone or locked by another backup
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+
+    return fd
+
+
+class ObjectStore:
+    """Blobs stored once under their SHA-256, shared by all snapshots of a backup root.
+
+    A blob is written to a temp file and synced before it is renamed into
+    place, so a blob that exists is complete and can be shared with any
+    snapshot. Blobs are touched when they are shared, so the garbage
+    collection can tell the ones a running backup may refer to.
+
+    Args:
+        root (str): The backup root.
+    """
+
+    def __init__(self, root):
+        self.path = os.path.join(root, OBJECTS_DIR_NAME)
+
+        self._lock = threading.Lock()
+        self._added = []
+
+
+    def put(self, data):
+        """Store a blob unless it is already present.
+
+        Returns:
+            str: The hash of the blob.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+
+        if os.path.exists(path):
+            os.utime(path)
+            return digest
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Concurrent writers of the same blob each use their own temp file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._added.append(path)
+
+        return digest
+
+
+    def flush(self):
+        """Return the directories of the blobs added since the last call, to be
+        synced. The blobs themselves are synced as they are added."""
+        with self._lock:
+            added, self._added = self._added, []
+
+        return sorted({ os.path.dirname(p) for p in added } | ({ self.path } if added else set()))
+
+
+    def get(self, digest):
+        with open(self.object_path(digest), 'rb') as f:
+            return f.read()
+
+
+    def object_path(self, digest):
+        return os.path.join(self.path, digest[:2], digest[2:])
+
+
+    def collect(self, referenced, grace=GC_GRACE_PERIOD):
+        """Remove the blobs not in `referenced`, and the temp files left by
+        killed backups, that weren't written nor shared for `grace` seconds.
+
+        Returns:
+            tuple: The number of files removed and their total size in bytes.
+        """
+        if not os.path.isdir(self.path):
+            return 0, 0
+
+        removed = 0
+        size = 0
+        expired = time.time() - grace
+        for dirpath, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                digest = os.path.basename(dirpath) + filename
+                stat = os.stat(path)
+                if digest in referenced or stat.st_mtime > expired:
+                    continue
+
+                os.remove(path)
+                removed += 1
+                size += stat.st_size
+
+        return removed, size
+
+
+def collect_garbage(root, grace=GC_GRACE_PERIOD):
+    """Remove the blobs of the object store of a backup root that no snapshot
+    refers to, e.g. the ones of deleted or aborted snapshots.
+
+    Returns:
+        tuple: The number of files removed and their total size in bytes.
+    """
+    referenced = set()
+    for snapshot_id in os.listdir(root):
+        path = os.path.join(root, snapshot_id)
+        if snapshot_id.startswith('.') or not os.path.isfile(os.path.join(path, MANIFEST_NAME)):
+            continue
+
+        snapshot = open_snapshot(path)
+        if isinstance(snapshot, ContentAddressedSnapshotReader):
+            referenced |= snapshot.blobs()
+
+    return ObjectStore(root).collect(referenced, grace)
+
+
+class DirectorySnapshotWriter:
+    """Write every item as a JSON file in a directory per config type.
+
+    Files are named after the IDs of the items, which unlike their display
+    names are unique. The manifest maps the IDs to the hashes, display names
+    and files of the items.
+
+    Args:
+        path (str): The snapshot directory.
+        pretty (bool): Whether items are indented, or written in their compact canonical form.
+    """
+
+    def __init__(self, path, pretty=True):
+        self.path = path
+        self.pretty = pretty
+
+        self._lock = threading.Lock()
+        self._dirs = set()
+        self._items = {}
+        self._index = {}
+
+
+    def write(self, content_type, item_id, name, content):
+        config_type = content_dir_name(content_type)
+        filename, file = self._write_file(content_type, item_id, dumps(content, self.pretty))
+        self._record(config_type, item_id, name, config_hash(content), file)
+
+        return filename
+
+
+    def close(self):
+        manifest = {
+            'format': 'directory',
+            'items': self._items,
+            'index': self._index
+        }
+
+        write_manifest(self.path, manifest, self.pretty)
+
+
+    # Private methods
+
+    def _write_file(self, content_type, item_id, data):
+        # Returns the path of the file, and its path relative to the snapshot
+        file = f"{content_dir_name(content_type)}/{item_filename(item_id)}.json"
+        filename = f"{self._content_path(content_type)}/{item_filename(item_id)}.json"
+        with open(filename, 'wb') as f:
+            f.write(data)
+
+        return filename, file
+
+
+    def _record(self, config_type, item_id, name, digest, file=None, snapshot=None):
+        with self._lock:
+            self._items.setdefault(config_type, {})[item_id] = digest
+            self._index.setdefault(config_type, {})[item_id] = index_entry(name, file, snapshot)
+
+
+    def _content_path(self, content_type):
+        path = f"{self.path}/{content_dir_name(content_type)}"
+        with self._lock:
+            if path not in self._dirs:
+                os.makedirs(path, exist_ok=True)
+                self._dirs.add(path)
+
+        return path
+
+
+class ContentAddressedSnapshotWriter:
+    """Store the config of every item in the object store of the backup root,
+    and record the ID to hash mapping of the snapshot in its manifest. The
+    hash of an item is the one of its blob. The rest of the item, e.g. the
+    cluster name and version, is kept in its index entry, so the same config
+    backed up from another cluster or version of CDM is stored once.
+    """
+
+    def __init__(self, path, store, pretty=True):
+        self.path = path
+        self.store = store
+        self.pretty = pretty
+
+        self._lock = threading.Lock()
+        self._items = {}
+        self._index = {}
+
+
+    def write(self, content_type, item_id, name, content):
+        config_type = content_dir_name(content_type)
+        digest = self.store.put(canonical_json(content['config']))
+        envelope = { k: v for k, v in content.items() if 'config' != k }
+        with self._lock:
+            self._items.setdefault(config_type, {})[item_id] = digest
+            self._index.setdefault(config_type, {})[item_id] = index_entry(name, envelope=envelope)
+
+        return self.store.object_path(digest)
+
+
+    def close(self):
+        manifest = {
+            'format': 'cas',
+            'items': self._items,
+            'index': self._index
+        }
+
+        write_manifest(self.path, manifest, self.pretty)
+
+
+class IncrementalSnapshotWriter(DirectorySnapshotWriter):
+    """Write only the items that were added or changed since the parent
+    snapshot. The manifest records the hashes of the full view, the items
+    added, changed and deleted, the parent the snapshot builds upon and the
+    length of the chain of incremental snapshots it ends.
+
+    Only the items written to this snapshot have a file in its index. The
+    others record the snapshot holding their content, so reading them doesn't
+    walk the chain.
+    """
+
+    def __init__(self, path, parent, pretty=True):
+        super().__init__(path, pretty)
+        self.parent = parent
+        self.depth = parent.depth + 1 if isinstance(parent, IncrementalSnapshotReader) else 1
+
+        self._parent_hashes = parent.hashes()
+        self._changes = {}
+
+
+    def write(self, content_type, item_id, name, content):
+        config_type = content_dir_name(content_type)
+        digest = config_hash(content)
+        parent_digest = self._parent_hashes.get(config_type, {}).get(item_id)
+
+        if digest == parent_digest:
+            self._record(config_type, item_id, name, digest, snapshot=self.parent.owner(config_type, item_id))
+            return self.parent.location(config_type, item_id)
+
+        filename, file = self._write_file(content_type, item_id, dumps(content, self.pretty))
+        self._record(config_type, item_id, name, digest, file)
+
+        change = 'added' if parent_digest is None else 'changed'
+        with self._lock:
+            self._changes.setdefault(config_type, {}).setdefault(change, []).append(item_id)
+
+        return filename
+
+
+    def close(self):
+        for config_type, hashes in self._parent_hashes.items():
+            deleted = sorted(set(hashes) - set(self._items.get(config_type, {})))
+            if deleted:
+                self._changes.setdefault(config_type, {})['deleted'] = deleted
+
+        manifest = {
+            'format': 'incremental',
+            'parent': os.path.basename(self.parent.path),
+            'depth': self.depth,
+            'items': self._items,
+            'index': self._index,
+            'changes': self._changes
+        }
+
+        write_manifest(self.path, manifest, self.pretty)
+
+
+class ArchiveSnapshotWriter:
+    """Stream every item as a JSON line into a single gzip file of the snapshot.
+
+    The lines are compressed in blocks, each an independent gzip member. The
+    archive is thus a plain `.jsonl.gz` file, while a single item is read by
+    decompressing only its block. The manifest records the hashes of the items
+    and the table of contents locating every item in the archive.
+    """
+
+    def __init__(self, path, block_size=ARCHIVE_BLOCK_SIZE, pretty=True):
+        self.path = path
+        self.block_size = block_size
+        self.pretty = pretty
+        self.archive_path = os.path.join(path, ARCHIVE_NAME)
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._offset = 0
+        self._block = bytearray()
+        self._pending = []
+        self._items = {}
+        self._index = {}
+        self._toc = {}
+
+
+    def write(self, content_type, item_id, name, content):
+        config_type = content_dir_name(content_type)
+        data = canonical_json(content)
+
+        with self._lock:
+            self._items.setdefault(config_type, {})[item_id] = config_hash(content)
+            self._index.setdefault(config_type, {})[item_id] = index_entry(name)
+            self._pending.append((config_type, item_id, len(self._block), len(data)))
+            self._block += data + b'\n'
+
+            if len(self._block) >= self.block_size:
+                self._flush()
+
+        return archive_location(self.archive_path, config_type, item_id)
+
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self._file:
+                self._file.close()
+
+        manifest = {
+            'format': 'archive',
+            'archive': ARCHIVE_NAME,
+            'items': self._items,
+            'index': self._index,
+            'toc': self._toc
+        }
+
+        write_manifest(self.path, manifest, self.pretty)
+
+
+    # Private methods
+
+    def _flush(self):
+        if not self._block:
+            return
+
+        if not self._file:
+            os.makedirs(self.path, exist_ok=True)
+            self._file = open(self.archive_path, 'wb')
+
+        compressor = zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS)
+        member = compressor.compress(bytes(self._block)) + compressor.flush()
+        self._file.write(member)
+
+        for config_type, item_id, offset, length in self._pending:
+            self._toc.setdefault(config_type, {})[item_id] = [self._offset, len(member), offset, length]
+
+        self._offset += len(member)
+        self._block = bytearray()
+        self._pending = []
+
+
+class ManifestSnapshotReader:
+    """Base of the readers of snapshots with a manifest, which lists the items
+    by config type and ID along with their hashes and display names, so no
+    directory is listed to find an item.
+    """
+
+    def __init__(self, path, manifest):
+        self.path = path
+        self.manifest = manifest
+
+
+    def config_types(self):
+        return list(self.manifest['items'].keys())
+
+
+    def ids(self, config_type):
+        return list(self.manifest['items'].get(config_type, {}).keys())
+
+
+    def name(self, config_type, item_id):
+        # Items of snapshots written before they had IDs are identified by their names
+        entry = self._entry(config_type, item_id)
+        return entry['name'] if entry else item_id
+
+
+    def items(self, config_type):
+        for item_id in self.ids(config_type):
+            yield self.read(config_type, item_id)
+
+
+    def hashes(self):
+        return self.manifest['items']
+
+
+    def owner(self, config_type, item_id):
+        """Return the ID of the snapshot holding the content of the item."""
+        return os.path.basename(self.path)
+
+
+    # Private methods
+
+    def _entry(self, config_type, item_id):
+        return (self.manifest or {}).get('index', {}).get(config_type, {}).get(item_id)
+
+
+class DirectorySnapshotReader(ManifestSnapshotReader):
+    """Reader of directory snapshots. Snapshots written before directory
+    snapshots had a manifest are listed from their directories instead, their
+    items identified by their file names.
+    """
+
+    def __init__(self, path, manifest=None):
+        super().__init__(path, manifest)
+
+
+    def config_types(self):
+        if self.manifest:
+            return super().config_types()
+
+        return [d for d in os.listdir(self.path)
+                if os.path.isdir(os.path.join(self.path, d))]
+
+
+    def ids(self, config_type):
+        if self.manifest:
+            return super().ids(config_type)
+
+        path = os.path.join(self.path, config_type)
+        if not os.path.isdir(path):
+            return []
+
+        return [os.path.splitext(f)[0] for f in os.listdir(path) if f.endswith('.json')]
+
+
+    def read(self, config_type, item_id):
+        return read_file(self.location(config_type, item_id))
+
+
+    def location(self, config_type, item_id):
+        entry = self._entry(config_type, item_id)
+        if entry:
+            return os.path.join(self.path, entry['file'])
+
+        return os.path.join(self.path, config_type, f"{item_id}.json")
+
+
+    def hashes(self):
+        if self.manifest:
+            return super().hashes()
+
+        return {
+            c: { i: config_hash(self.read(c, i)) for i in self.ids(c) }
+            for c in self.config_types()
+        }
+
+
+class IncrementalSnapshotReader(DirectorySnapshotReader):
+    """Full view of an incremental snapshot. Items that were not written to
+    this snapshot are read from the snapshot their index entry refers to, or
+    for snapshots written before index entries did, looked up in the parents.
+
+    Chains of incremental snapshots may be long, so the parent is only opened
+    when needed and the lookups walk the chain iteratively.
+    """
+
+    def __init__(self, path, manifest):
+        super().__init__(path, manifest)
+        self._snapshots = {}
+
+
+    @property
+    def parent(self):
+        return self._open(self.manifest['parent'])
+
+
+    @property
+    def depth(self):
+        """Number of incremental snapshots from the latest full one up to this one."""
+        depth = 0
+        snapshot = self
+        while isinstance(snapshot, IncrementalSnapshotReader):
+            if 'depth' in snapshot.manifest:
+                return depth + snapshot.manifest['depth']
+            depth += 1
+            snapshot = snapshot.parent
+
+        return depth
+
+
+    def read(self, config_type, item_id):
+        snapshot, path = self._find(config_type, item_id)
+        return read_file(path) if path else snapshot.read(config_type, item_id)
+
+
+    def location(self, config_type, item_id):
+        snapshot, path = self._find(config_type, item_id)
+        return path or snapshot.location(config_type, item_id)
+
+
+    def owner(self, config_type, item_id):
+        snapshot, _ = self._find(config_type, item_id)
+        return os.path.basename(snapshot.path)
+
+
+    # Private methods
+
+    def _find(self, config_type, item_id):
+        # The snapshot holding the content of the item, and its file if it is an incremental snapshot
+        snapshot = self
+        while isinstance(snapshot, IncrementalSnapshotReader):
+            path = snapshot._own_location(config_type, item_id)
+            if path:
+                return snapshot, path
+
+            entry = snapshot._entry(config_type, item_id)
+            if entry and 'snapshot' in entry:
+                snapshot = self._open(entry['snapshot'])
+            else:
+                snapshot = snapshot.parent
+
+        return snapshot, None
+
+
+    def _open(self, snapshot_id):
+        if snapshot_id not in self._snapshots:
+            self._snapshots[snapshot_id] = open_snapshot(os.path.join(os.path.dirname(self.path), snapshot_id))
+
+        return self._snapshots[snapshot_id]
+
+
+    def _own_location(self, config_type, item_id):
+        # The file of the item if it was written to this snapshot, None otherwise
+        entry = self._entry(config_type, item_id)
+        if entry:
+            return os.path.join(self.path, entry['file']) if 'file' in entry else None
+
+        path = super().location(config_type, item_id)
+        return path if os.path.isfile(path) else None
+
+
+class ContentAddressedSnapshotReader(ManifestSnapshotReader):
+
+    def __init__(self, path, manifest, store):
+        super().__init__(path, manifest)
+        self.store = store
+
+
+    def read(self, config_type, item_id):
+        data = loads(self.store.get(self._blob(config_type, item_id)))
+
+        # Blobs of snapshots written before the envelope was kept in the index hold whole items
+        entry = self._entry(config_type, item_id)
+        if entry and 'envelope' in entry:
+            return dict(entry['envelope'], config=data)
+
+        return data
+
+
+    def location(self, config_type, item_id):
+        return self.store.object_path(self._blob(config_type, item_id))
+
+
+    def blobs(self):
+        """Return the hashes of the blobs the snapshot refers to."""
+        return { self._blob(c, i) for c in self.config_types() for i in self.ids(c) }
+
+
+    # Private methods
+
+    def _blob(self, config_type, item_id):
+        # Some snapshots written before the envelope was kept in the index record the blobs apart
+        entry = self._entry(config_type, item_id)
+        if entry and 'blob' in entry:
+            return entry['blob']
+
+        return self.manifest['items'][config_type][item_id]
+
+
+class ArchiveSnapshotReader(ManifestSnapshotReader):
+
+    def __init__(self, path, manifest, cached_blocks=16):
+        super().__init__(path, manifest)
+        self.archive_path = os.path.join(path, manifest['archive'])
+
+        # Items of a config type are mostly stored in the same few blocks
+        self._read_block = functools.lru_cache(maxsize=cached_blocks)(self._read_block)
+
+
+    def read(self, config_type, item_id):
+        block_offset, block_length, offset, length = self.manifest['toc'][config_type][item_id]
+        block = self._read_block(block_offset, block_length)
+
+        return loads(block[offset:offset + length])
+
+
+    def location(self, config_type, item_id):
+        return archive_location(self.archive_path, config_type, item_id)
+
+
+    def items(self, config_type):
+        # In archive order, so every block is decompressed once
+        toc = self.manifest['toc'].get(config_type, {})
+        for item_id in sorted(toc, key=lambda i: (toc[i][0], toc[i][2])):
+            yield self.read(config_type, item_id)
+
+
+    # Private methods
+
+    def _read_block(self, block_offset, block_length):
+        with open(self.archive_path, 'rb') as f:
+            f.seek(block_offset)
+            return zlib.decompress(f.read(block_length), GZIP_WBITS)
+
+
+class MemorySnapshot:
+    """Snapshot kept in memory, written and read like the ones on disk."""
+
+    def __init__(self):
+        self.path = None
+
+        self._lock = threading.Lock()
+        self._items = {}
+        self._names = {}
+
+
+    def write(self, content_type, item_id, name, content):
+        config_type = content_dir_name(content_type)
+        with self._lock:
+            self._items.setdefault(config_type, {})[item_id] = content
+            self._names.setdefault(config_type, {})[item_id] = name
+
+        return self.location(config_type, item_id)
+
+
+    def close(self):
+        pass
+
+
+    def config_types(self):
+        return list(self._items.keys())
+
+
+    def ids(self, config_type):
+        return list(self._items.get(config_type, {}).keys())
+
+
+    def name(self, config_type, item_id):
+        return self._names[config_type][item_id]
+
+
+    def read(self, config_type, item_id):
+        return self._items[config_type][item_id]
+
+
+    def location(self, config_type, item_id):
+        return f"memory#{config_type}/{item_id}"
+
+
+    def items(self, config_type):
+        for item_id in self.ids(config_type):
+            yield self.read(config_type, item_id)
+
+
+    def hashes(self):
+        return {
+            c: { i: config_hash(content) for i, content in items.items() }
+            for c, items in self._items.items()
+        }
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from rubrik_config.transport import TransportError
+
+
+TERMINAL_STATUSES = { 'SUCCEEDED', 'FAILED', 'CANCELED' }
+
+# Default number of concurrent status requests, independent of the backup and restore workers
+WATCH_WORKERS = 16
+
+
+class StatusWatcher:
+    """Follow the status of restore jobs until they all reach a terminal state.
+
+    Every job is polled by its own coroutine. The polling interval of a job
+    starts at `min_interval` and doubles, up to `max_interval`, for as long as
+    its status stays the same or can't be queried. Only jobs in a terminal
+    state, or whose type has no status, are no longer polled.
+
+    Args:
+        jobs (list): The jobs of the restore log.
+        instances (dict): Config class instance for each config type, used to
+                          query the status of its jobs.
+        on_change (callable): Called with the list of known job statuses
+                              whenever at least one of them changed.
+        workers (int): Maximum number of concurrent status requests.
+        min_interval (float): Initial polling interval, in seconds.
+        max_interval (float): Maximum polling interval, in seconds.
+    """
+
+    def __init__(self, jobs, instances, on_change, workers=WATCH_WORKERS, min_interval=2, max_interval=60):
+        self.jobs = jobs
+        self.instances = instances
+        self.on_change = on_change
+        self.workers = workers
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+        self.statuses = [None] * len(jobs)
+
+
+    def run(self):
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._watch(loop))
+        finally:
+            loop.close()
+
+        return [s for s in self.statuses if s]
+
+
+    # Private methods
+
+    async def _watch(self, loop):
+        self._changed = asyncio.Event()
+        self._done = False
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            drawer = asyncio.ensure_future(self._redraw())
+            await asyncio.gather(*[self._poll(loop, executor, i) for i in range(len(self.jobs))])
+
+            self._done = True
+            self._changed.set()
+            await drawer
+
+
+    async def _poll(self, loop, executor, index):
+        job = self.jobs[index]
+        instance = self.instances[job['configType']]
+        interval = self.min_interval
+
+        while True:
+            try:
+                status = await loop.run_in_executor(executor, instance.status, job)
+            except TransportError as e:
+                # Transient errors must not end the watch of the job, it is polled again later
+                logging.warning("Unable to get the status of `%s`: %s" % (job['name'], e))
+                interval = min(interval * 2, self.max_interval)
+                await asyncio.sleep(interval)
+                continue
+
+            if status != self.statuses[index]:
+                self.statuses[index] = status
+                self._changed.set()
+                interval = self.min_interval
+            else:
+                interval = min(interval * 2, self.max_interval)
+
+            if not status or status[0] in TERMINAL_STATUSES:
+                return
+
+            await asyncio.sleep(interval)
+
+
+    async def _redraw(self):
+        while True:
+            await self._changed.wait()
+
+            # Give concurrent pollers a moment so that changes are drawn together
+            await asyncio.sleep(0.1)
+            self._changed.clear()
+
+            self.on_change([s for s in self.statuses if s])
+
+            if self._done:
+                return
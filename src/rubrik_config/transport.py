@@ -0,0 +1,199 @@
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rubrik_config.rate_limiter import RateLimiter
+from rubrik_config.serialization import dumps, loads
+
+
+# Timeouts, in seconds, of the endpoints that are slower than the default.
+# The longest matching endpoint prefix wins.
+DEFAULT_TIMEOUTS = {
+    '/archive/object_store': 120,
+    '/archive/nfs': 120,
+    '/replication/target': 120,
+    '/report': 120,
+}
+
+# Status codes the cluster answers with when it is overloaded or restarting
+OVERLOADED_STATUS_CODES = { 429, 502, 503, 504 }
+
+
+class TransportError(Exception):
+    """API call failure. `status_code` is None when no response was received."""
+
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+        try:
+            self.retry_after = float(retry_after) if retry_after else None
+        except ValueError:
+            self.retry_after = None
+
+
+class Transport:
+    """Client of the CDM REST API sharing a pool of keep-alive connections.
+
+    Connections, and with them their TLS sessions, are reused across all the
+    API calls made by the config classes. Its `get`, `post` and `patch` methods
+    mirror the ones of `rubrik_cdm.Connect`, which it replaces.
+
+    Args:
+        address (str): Address of the cluster. May include a scheme and port,
+                       otherwise https is used.
+        api_token (str): API token used to authenticate.
+        pool_size (int): Maximum number of open connections. Callers wait for
+                         a free connection rather than opening more.
+        timeouts (dict): Timeout, in seconds, per endpoint prefix.
+        default_timeout (float): Timeout of the endpoints without a specific one.
+        limiter (RateLimiter): Admission control of the requests. Defaults to
+                               a limiter bounded by `pool_size`.
+        retries (int): Number of retries of a request that failed because the
+                       cluster was overloaded or unreachable. Only idempotent
+                       GETs are retried after a timeout or connection error;
+                       writes are only retried when they were rejected with 429.
+        backoff (float): Base delay, in seconds, of the jittered exponential
+                         backoff between retries.
+        recorder (CallRecorder): Records every call, if given.
+    """
+
+    def __init__(self, address, api_token, pool_size=10, timeouts=DEFAULT_TIMEOUTS, default_timeout=15,
+                 limiter=None, retries=3, backoff=1, recorder=None):
+        self.base_url = address if '://' in address else f"https://{address}"
+        self.timeouts = timeouts
+        self.default_timeout = default_timeout
+        self.limiter = limiter if limiter else RateLimiter(max_concurrency=pool_size)
+        self.retries = retries
+        self.backoff = backoff
+        self.recorder = recorder
+
+        self._lock = threading.Lock()
+        self._stats = { 'requests': 0, 'retries': 0, 'errors': 0 }
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.verify = False
+        self.session.headers.update({
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+            'Authorization': f"Bearer {api_token}",
+        })
+
+
+    def get(self, api_version, api_endpoint, timeout=None, params=None):
+        return self.request('GET', api_version, api_endpoint, timeout=timeout, params=params)
+
+
+    def post(self, api_version, api_endpoint, config, timeout=None):
+        return self.request('POST', api_version, api_endpoint, config=config, timeout=timeout)
+
+
+    def patch(self, api_version, api_endpoint, config, timeout=None):
+        return self.request('PATCH', api_version, api_endpoint, config=config, timeout=timeout)
+
+
+    def request(self, method, api_version, api_endpoint, config=None, timeout=None, params=None):
+        url = f"{self.base_url}/api/{api_version}{api_endpoint}"
+        data = dumps(config) if config is not None else None
+        timeout = timeout or self.timeout(api_endpoint)
+
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                result, status, size = self._send(method, url, api_endpoint, data, timeout, params)
+                self._record(method, api_version, api_endpoint, status, started, size, attempt)
+
+                return result
+
+            except TransportError as e:
+                if attempt >= self.retries or not self._is_retryable(method, e):
+                    self._count('errors')
+                    self._record(method, api_version, api_endpoint, e.status_code or 0, started,
+                                 len(data or ''), attempt)
+                    raise
+
+                attempt += 1
+                self._count('retries')
+
+                # Full jitter, unless the cluster told us how long to wait
+                delay = e.retry_after if e.retry_after else random.uniform(0, self.backoff * 2 ** attempt)
+                time.sleep(delay)
+
+
+    def stats(self):
+        """Return the request, retry, error and throttling counters."""
+        with self._lock:
+            stats = dict(self._stats)
+
+        stats['throttled'] = self.limiter.throttled
+        stats['concurrency'] = int(self.limiter.concurrency)
+
+        return stats
+
+
+    def timeout(self, api_endpoint):
+        path = api_endpoint.split('?')[0]
+        matches = [p for p in self.timeouts if path.startswith(p)]
+
+        return self.timeouts[max(matches, key=len)] if matches else self.default_timeout
+
+
+    def close(self):
+        self.session.close()
+
+
+    # Private methods
+
+    def _send(self, method, url, api_endpoint, data, timeout, params):
+        self.limiter.acquire()
+        self._count('requests')
+
+        started = time.monotonic()
+        overloaded = True
+        try:
+            response = self.session.request(method, url, data=data, params=params, timeout=timeout)
+            overloaded = response.status_code in OVERLOADED_STATUS_CODES
+        except requests.exceptions.Timeout:
+            raise TransportError("The Rubrik cluster did not respond to `{} {}` in time.".format(method, api_endpoint))
+        except requests.exceptions.ConnectionError:
+            raise TransportError("Unable to establish a connection to the Rubrik cluster.")
+        finally:
+            self.limiter.release(time.monotonic() - started, overloaded)
+
+        if response.status_code >= 400:
+            try:
+                message = loads(response.content)['message']
+            except (ValueError, KeyError, TypeError):
+                message = response.text
+            raise TransportError(message, response.status_code, response.headers.get('Retry-After'))
+
+        size = len(data or '') + len(response.content)
+        if 204 == response.status_code or not response.content:
+            return {}, response.status_code, size
+
+        return loads(response.content), response.status_code, size
+
+
+    def _is_retryable(self, method, error):
+        if 429 == error.status_code:
+            return True
+
+        return 'GET' == method and (error.status_code is None or error.status_code in OVERLOADED_STATUS_CODES)
+
+
+    def _record(self, method, api_version, api_endpoint, status, started, size, retries):
+        if self.recorder:
+            self.recorder.record(method, api_version, api_endpoint, status, time.monotonic() - started, size, retries)
+
+
+    def _count(self, counter):
+        with self._lock:
+            self._stats[counter] += 1
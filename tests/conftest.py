@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from bench_runner import non_interactive
+from mock_cdm import MockCDMServer, MockCluster
+from rubrik_config.runner import Runner
+
+
+@pytest.fixture(autouse=True)
+def quiet(tmp_path, monkeypatch):
+    """Answer every prompt, and keep the restore log and journal out of the working directory."""
+    monkeypatch.chdir(tmp_path)
+    with non_interactive():
+        yield
+
+
+@pytest.fixture
+def cluster():
+    """A mock cluster holding a few objects of every config type."""
+    with MockCDMServer(MockCluster(30)) as server:
+        yield server
+
+
+@pytest.fixture
+def backup_root(tmp_path):
+    return str(tmp_path / 'backups')
+
+
+@pytest.fixture
+def make_runner(backup_root):
+    """Return a runner connected to the given mock cluster."""
+    def make(server, **kwargs):
+        runner = Runner(backup_root, rate_limit=100000, **kwargs)
+        runner._connect({ 'address': server.address, 'api_token': 'test' })
+        return runner
+
+    return make
@@ -0,0 +1,145 @@
+import json
+import os
+import shutil
+import sqlite3
+
+from rubrik_config.catalog import CATALOG_NAME, SCHEMA_VERSION, Catalog
+from rubrik_config.runner import Runner
+
+
+def test_prune_drops_deleted_snapshots(cluster, make_runner, backup_root):
+    kept = make_runner(cluster).backup()['backupId']
+    pruned = make_runner(cluster).backup()['backupId']
+
+    shutil.rmtree(os.path.join(backup_root, pruned))
+
+    catalog = Catalog(backup_root)
+    assert [s['snapshot_id'] for s in catalog.snapshots()] == [kept]
+    assert not catalog.items(snapshot_id=pruned)
+    assert catalog.items(snapshot_id=kept)
+    catalog.close()
+
+
+def test_incremental_backup_after_pruning_the_latest(cluster, make_runner, backup_root):
+    first = make_runner(cluster).backup()['backupId']
+    latest = make_runner(cluster).backup()['backupId']
+    shutil.rmtree(os.path.join(backup_root, latest))
+
+    result = make_runner(cluster, incremental=True).backup()
+
+    catalog = Catalog(backup_root)
+    snapshots = { s['snapshot_id']: s for s in catalog.snapshots() }
+    catalog.close()
+    assert set(snapshots) == {first, result['backupId']}
+    assert 'incremental' == snapshots[result['backupId']]['format']
+
+
+def test_diff_and_restore_ignore_pruned_snapshots(cluster, make_runner, backup_root):
+    first = make_runner(cluster).backup()['backupId']
+    pruned = make_runner(cluster).backup()['backupId']
+    shutil.rmtree(os.path.join(backup_root, pruned))
+
+    runner = make_runner(cluster)
+    assert runner.diff([first, pruned]) is None
+    assert runner.restore(backup_id=pruned) is None
+
+
+def write_legacy_snapshot(path, items):
+    # The layout of the released tool: a directory of JSON files per config type
+    for config_type, name, content in items:
+        os.makedirs(os.path.join(path, config_type), exist_ok=True)
+        with open(os.path.join(path, config_type, f"{name}.json"), 'w') as f:
+            json.dump(content, f)
+
+
+def test_legacy_snapshots_are_indexed(backup_root):
+    content = { 'clusterName': 'test', 'clusterVersion': '5.0', 'type': 'sla_domain', 'config': { 'name': 'Gold' } }
+    write_legacy_snapshot(os.path.join(backup_root, '2020-01-01_00-00-00'), [('sla_domain', 'Gold', content)])
+
+    catalog = Catalog(backup_root)
+    assert [(s['snapshot_id'], s['legacy']) for s in catalog.snapshots()] == [('2020-01-01_00-00-00', 1)]
+    catalog.close()
+
+
+def test_legacy_items_are_indexed_by_display_name(backup_root):
+    sla = { 'clusterName': 'test', 'clusterVersion': '5.0', 'type': 'sla_domain', 'config': { 'name': 'Gold/1' } }
+    nfs = { 'clusterName': 'test', 'clusterVersion': '5.0', 'type': 'archival_location.nfs',
+            'config': { 'definition': { 'name': 'NFS 1' } } }
+    write_legacy_snapshot(os.path.join(backup_root, '2020-01-01_00-00-00'),
+                          [('sla_domain', 'Gold_1', sla), ('archival_location', 'NFS_1', nfs)])
+
+    catalog = Catalog(backup_root)
+    assert [i['item_id'] for i in catalog.items(name='Gold/1')] == ['Gold_1']
+    assert [i['item_id'] for i in catalog.items(name='NFS 1')] == ['NFS_1']
+    catalog.close()
+
+
+def test_converting_a_legacy_snapshot_keeps_its_status(backup_root):
+    content = { 'clusterName': 'test', 'clusterVersion': '5.0', 'type': 'sla_domain', 'config': { 'name': 'Gold' } }
+    write_legacy_snapshot(os.path.join(backup_root, '2020-01-01_00-00-00'), [('sla_domain', 'Gold', content)])
+    Catalog(backup_root).close()
+
+    # Already in the directory format, the snapshot stays without marker
+    Runner(backup_root).convert('directory')
+    catalog = Catalog(backup_root)
+    assert [(s['format'], s['legacy']) for s in catalog.snapshots()] == [('directory', 1)]
+    catalog.close()
+
+    # A converted snapshot gets a marker
+    Runner(backup_root).convert('archive')
+    catalog = Catalog(backup_root)
+    assert [(s['format'], s['legacy']) for s in catalog.snapshots()] == [('archive', 0)]
+    assert [i['name'] for i in catalog.items()] == ['Gold']
+    catalog.close()
+
+
+def test_catalog_of_a_fleet_root_indexes_no_snapshot(cluster, make_runner, backup_root):
+    # Every cluster of a fleet has its own backup root under the fleet root
+    fleet_root = os.path.dirname(backup_root)
+    make_runner(cluster).backup()
+
+    catalog = Catalog(fleet_root)
+    assert not catalog.snapshots()
+    catalog.close()
+
+
+def test_unreadable_snapshots_are_skipped(backup_root):
+    content = { 'clusterName': 'test', 'clusterVersion': '5.0', 'type': 'sla_domain', 'config': { 'name': 'Gold' } }
+    write_legacy_snapshot(os.path.join(backup_root, '2020-01-01_00-00-00'), [('sla_domain', 'Gold', content)])
+    write_legacy_snapshot(os.path.join(backup_root, '2020-01-02_00-00-00'), [('sla_domain', 'Gold', ['not an item'])])
+
+    catalog = Catalog(backup_root)
+    assert [s['snapshot_id'] for s in catalog.snapshots()] == ['2020-01-01_00-00-00']
+    catalog.close()
+
+
+def test_catalog_of_the_first_schema_is_migrated(cluster, make_runner, backup_root):
+    backup_id = make_runner(cluster).backup()['backupId']
+    catalog = Catalog(backup_root)
+    expected = [(i['config_type'], i['item_id'], i['name'], i['hash']) for i in catalog.items()]
+    catalog.close()
+
+    # Items were keyed by name and hashed along with their envelope, snapshots had no legacy flag
+    os.remove(os.path.join(backup_root, CATALOG_NAME))
+    db = sqlite3.connect(os.path.join(backup_root, CATALOG_NAME))
+    with db:
+        db.execute("""
+            CREATE TABLE snapshots (
+                snapshot_id TEXT PRIMARY KEY, format TEXT, cluster_name TEXT, cluster_version TEXT, item_count INTEGER
+            )""")
+        db.execute("""
+            CREATE TABLE items (
+                snapshot_id TEXT, cluster_name TEXT, cluster_version TEXT, config_type TEXT, content_type TEXT,
+                name TEXT, hash TEXT, size INTEGER, path TEXT, PRIMARY KEY (snapshot_id, config_type, name)
+            )""")
+        db.execute('CREATE INDEX items_name ON items (name)')
+        db.execute("INSERT INTO snapshots VALUES (?, 'directory', 'test', '5.0', 1)", (backup_id, ))
+        db.execute("INSERT INTO items VALUES (?, 'test', '5.0', 'sla_domain', 'sla_domain', 'Gold', 'stale', 2, 'x')",
+                   (backup_id, ))
+    db.close()
+
+    catalog = Catalog(backup_root)
+    assert catalog.db.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION
+    assert [(s['snapshot_id'], s['legacy']) for s in catalog.snapshots()] == [(backup_id, 0)]
+    assert [(i['config_type'], i['item_id'], i['name'], i['hash']) for i in catalog.items()] == expected
+    catalog.close()
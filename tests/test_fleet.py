@@ -0,0 +1,19 @@
+import os
+import socket
+
+from rubrik_config.fleet import _backup_cluster
+
+
+def test_unreachable_cluster_reports_transport_error(tmp_path):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+
+    cluster = { 'name': 'down', 'address': f"127.0.0.1:{port}", 'api_token': 'token' }
+    fds = len(os.listdir('/proc/self/fd'))
+
+    result = _backup_cluster(str(tmp_path / 'fleet'), cluster, { 'retries': 0 })
+
+    assert result['backupId'] is None
+    assert result['error'] and result['error'] != 'Connection failed'
+    assert len(os.listdir('/proc/self/fd')) == fds
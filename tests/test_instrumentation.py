@@ -0,0 +1,19 @@
+import pytest
+
+from rubrik_config.instrumentation import percentile
+
+
+@pytest.mark.parametrize('values, p, expected', [
+    (list(range(1, 21)), 95, 19),
+    (list(range(1, 21)), 50, 10),
+    (list(range(1, 21)), 100, 20),
+    ([1, 2], 50, 1),
+    ([1, 2], 51, 2),
+    ([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 90, 9),
+    ([7], 0, 7),
+    ([7], 99, 7),
+    (list(range(1, 101)), 7, 7),
+    ([], 50, 0),
+])
+def test_nearest_rank_percentile(values, p, expected):
+    assert expected == percentile(values, p)
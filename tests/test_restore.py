@@ -0,0 +1,66 @@
+import logging
+
+from mock_cdm import MockCDMServer, MockCluster
+
+from rubrik_config.journal import RestoreJournal
+from rubrik_config.secret_store import MissingSecretError
+from rubrik_config.sla_domain import SlaDomainConfig
+from rubrik_config.snapshot import config_hash
+
+
+def sla_domain(name):
+    return { 'clusterName': 'test', 'clusterVersion': '5.3', 'type': 'sla_domain', 'config': { 'name': name } }
+
+
+def test_item_with_missing_secret_is_journaled_as_failed(tmp_path):
+    journal = RestoreJournal(str(tmp_path / 'journal'))
+    config = SlaDomainConfig(str(tmp_path), None, logging.getLogger('test'), workers=2, journal=journal)
+
+    def restore_item(item):
+        if 'Bronze' == item['config']['name']:
+            raise MissingSecretError('No password secret for `replication_target/Bronze`')
+        return { 'id': item['config']['name'] }
+
+    items = [sla_domain(n) for n in ('Gold', 'Bronze', 'Silver')]
+    jobs = config._restore_items(items, restore_item)
+    journal.close()
+
+    state = RestoreJournal.replay(str(tmp_path / 'journal'))
+    assert sorted(j['id'] for j in jobs) == ['Gold', 'Silver']
+    assert set(state['failed']) == {('sla_domain', config_hash(sla_domain('Bronze')))}
+    assert 'secret' in state['failed'][('sla_domain', config_hash(sla_domain('Bronze')))]
+    assert len(state['done']) == 2
+
+
+def test_restore_again_creates_nothing(cluster, make_runner):
+    backup_id = make_runner(cluster).backup()['backupId']
+
+    with MockCDMServer(MockCluster()) as target:
+        make_runner(target).restore(backup_id=backup_id)
+        restored = target.cluster.count()
+        make_runner(target).restore(backup_id=backup_id)
+
+        assert restored == cluster.cluster.count()
+        assert target.cluster.count() == restored
+
+
+def test_resume_restores_the_items_that_failed(cluster, make_runner, monkeypatch):
+    backup_id = make_runner(cluster).backup()['backupId']
+
+    with MockCDMServer(MockCluster()) as target:
+        post = target.cluster._post
+
+        def failing_post(collection, body):
+            if '/sla_domain' == collection:
+                return 500, { 'message': 'Injected failure' }
+            return post(collection, body)
+
+        with monkeypatch.context() as m:
+            m.setattr(target.cluster, '_post', failing_post)
+            make_runner(target).restore(backup_id=backup_id)
+
+        assert target.cluster.count('/sla_domain') == 0
+        assert target.cluster.count() == cluster.cluster.count() - cluster.cluster.count('/sla_domain')
+
+        make_runner(target).restore(resume=True)
+        assert target.cluster.count() == cluster.cluster.count()
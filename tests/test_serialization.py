@@ -0,0 +1,24 @@
+import pytest
+
+from rubrik_config import serialization
+from rubrik_config.serialization import canonical_json
+
+pytest.importorskip('orjson')
+
+
+def standard_canonical_json(content, monkeypatch):
+    with monkeypatch.context() as m:
+        m.setattr(serialization, 'BACKEND', 'json')
+        return canonical_json(content)
+
+
+@pytest.mark.parametrize('content', [
+    { 'name': ''.join(chr(c) for c in range(0x80)) },
+    { 'name': 'del\x7f', 'nested': ['\x00', '\x1f', '\t\n\r'] },
+    { 'name': 'Gold/1', 'frequency': 1, 'enabled': True, 'parent': None },
+    { 'name': 'é', 'ratio': 1e16 },
+])
+def test_backends_produce_the_same_canonical_bytes(content, monkeypatch):
+    monkeypatch.setattr(serialization, 'BACKEND', 'orjson')
+
+    assert canonical_json(content) == standard_canonical_json(content, monkeypatch)
@@ -0,0 +1,192 @@
+import logging
+import os
+import shutil
+
+import pytest
+
+from rubrik_config.catalog import Catalog
+from rubrik_config.runner import Runner
+from rubrik_config.serialization import canonical_json
+from rubrik_config.snapshot import (OBJECTS_DIR_NAME, STAGING_DIR_NAME, ContentAddressedSnapshotWriter,
+                                    DirectorySnapshotWriter, ObjectStore, SnapshotStaging, collect_garbage,
+                                    get_snapshot_format, is_complete, list_snapshots, open_snapshot,
+                                    remove_stale_staging, write_manifest)
+
+
+def sla_domain(name, cluster='test', version='5.3', **config):
+    return { 'clusterName': cluster, 'clusterVersion': version, 'type': 'sla_domain', 'config': dict(config, name=name) }
+
+
+def stage(root, snapshot_id, names=('Gold', 'Silver')):
+    staging = SnapshotStaging(root, snapshot_id)
+    writer = DirectorySnapshotWriter(staging.path)
+    for name in names:
+        writer.write('sla_domain', f"SlaDomain:::{name}", name, sla_domain(name))
+    writer.close()
+    return staging
+
+
+def test_commit_publishes_a_complete_snapshot(tmp_path):
+    root = str(tmp_path)
+    staging = stage(root, 'snap')
+    assert not list_snapshots(root)
+
+    staging.commit()
+
+    assert staging.committed
+    assert ['snap'] == list_snapshots(root)
+    assert is_complete(staging.final_path)
+    assert 'Gold' == open_snapshot(staging.final_path).read('sla_domain', 'SlaDomain:::Gold')['config']['name']
+    assert not os.listdir(os.path.join(root, STAGING_DIR_NAME))
+
+
+def test_abort_leaves_nothing_behind(tmp_path):
+    root = str(tmp_path)
+    staging = stage(root, 'snap')
+
+    staging.abort()
+
+    assert not staging.committed
+    assert not list_snapshots(root)
+    assert not os.listdir(os.path.join(root, STAGING_DIR_NAME))
+
+
+def test_snapshots_of_the_same_id_get_a_suffix(tmp_path):
+    root = str(tmp_path)
+    stage(root, 'snap').commit()
+    staged = stage(root, 'snap')
+    stage(root, 'snap').commit()
+    staged.commit()
+
+    assert ['snap', 'snap-01', 'snap-02'] == list_snapshots(root)
+
+
+def test_commit_refuses_to_replace_a_snapshot(tmp_path):
+    root = str(tmp_path)
+    staging = stage(root, 'snap')
+    os.makedirs(staging.final_path)
+
+    with pytest.raises(FileExistsError):
+        staging.commit()
+
+
+def test_only_staging_directories_of_killed_backups_are_removed(tmp_path):
+    root = str(tmp_path)
+    running = stage(root, 'running')
+    os.makedirs(os.path.join(root, STAGING_DIR_NAME, 'killed', 'sla_domain'))
+    os.makedirs(os.path.join(root, STAGING_DIR_NAME, 'snap.convert'))
+
+    assert ['killed'] == remove_stale_staging(root)
+
+    assert sorted(os.listdir(os.path.join(root, STAGING_DIR_NAME))) == ['running', 'snap.convert']
+    running.commit()
+    assert ['running'] == list_snapshots(root)
+
+
+def test_backup_logs_the_published_paths(cluster, make_runner, backup_root, caplog):
+    caplog.set_level(logging.INFO)
+    os.makedirs(os.path.join(backup_root, STAGING_DIR_NAME, 'killed'))
+
+    backup_id = make_runner(cluster).backup()['backupId']
+
+    with open(os.path.join(backup_root, backup_id, 'output.log')) as f:
+        log = f.read()
+    assert 'successfully saved to ' + os.path.join(backup_root, backup_id) in log
+    assert f"API call report written to {os.path.join(backup_root, backup_id, 'api_calls.json')}" in log
+    assert STAGING_DIR_NAME not in log.replace('staging directory', '')
+    assert not os.listdir(os.path.join(backup_root, STAGING_DIR_NAME))
+
+
+def write_cas_snapshot(root, snapshot_id, items):
+    writer = ContentAddressedSnapshotWriter(os.path.join(root, snapshot_id), ObjectStore(root))
+    for item in items:
+        writer.write('sla_domain', f"SlaDomain:::{item['config']['name']}", item['config']['name'], item)
+    writer.close()
+
+
+def objects(root):
+    return sorted(f for _, _, files in os.walk(os.path.join(root, OBJECTS_DIR_NAME)) for f in files)
+
+
+def test_cas_stores_a_config_once_across_clusters_and_versions(tmp_path):
+    root = str(tmp_path)
+    prod = sla_domain('Gold', cluster='prod', version='5.3', frequency=1)
+    dr = sla_domain('Gold', cluster='dr', version='6.0', frequency=1)
+
+    write_cas_snapshot(root, 'prod', [prod])
+    write_cas_snapshot(root, 'dr', [dr])
+
+    assert 1 == len(objects(root))
+    assert prod == open_snapshot(os.path.join(root, 'prod')).read('sla_domain', 'SlaDomain:::Gold')
+    assert dr == open_snapshot(os.path.join(root, 'dr')).read('sla_domain', 'SlaDomain:::Gold')
+
+
+def test_cas_snapshots_holding_whole_items_are_read(tmp_path):
+    root = str(tmp_path)
+    item = sla_domain('Gold')
+    digest = ObjectStore(root).put(canonical_json(item))
+    write_manifest(os.path.join(root, 'old'), {
+        'format': 'cas',
+        'items': { 'sla_domain': { 'SlaDomain:::Gold': digest } },
+        'index': { 'sla_domain': { 'SlaDomain:::Gold': { 'name': 'Gold' } } }
+    })
+
+    assert item == open_snapshot(os.path.join(root, 'old')).read('sla_domain', 'SlaDomain:::Gold')
+
+
+def test_gc_removes_the_objects_no_snapshot_refers_to(tmp_path):
+    root = str(tmp_path)
+    write_cas_snapshot(root, 'kept', [sla_domain('Gold'), sla_domain('Silver')])
+    write_cas_snapshot(root, 'deleted', [sla_domain('Gold'), sla_domain('Bronze')])
+    shutil.rmtree(os.path.join(root, 'deleted'))
+    leftover = os.path.join(root, OBJECTS_DIR_NAME, 'ab', 'cdef.123.456.tmp')
+    os.makedirs(os.path.dirname(leftover), exist_ok=True)
+    with open(leftover, 'wb') as f:
+        f.write(b'{"name": "Gol')
+
+    # Recent objects may belong to a backup still running
+    assert (0, 0) == collect_garbage(root)
+    assert 4 == len(objects(root))
+
+    removed, _ = collect_garbage(root, grace=0)
+
+    assert 2 == removed
+    assert 2 == len(objects(root))
+    kept = open_snapshot(os.path.join(root, 'kept'))
+    assert ['Gold', 'Silver'] == sorted(kept.read('sla_domain', i)['config']['name'] for i in kept.ids('sla_domain'))
+
+
+# The source is moved away first, then the converted snapshot is moved in its place
+@pytest.mark.parametrize('interrupted', [1, 2], ids=['moving the source away', 'moving the conversion in place'])
+def test_interrupted_conversion_is_recovered(cluster, make_runner, backup_root, monkeypatch, interrupted):
+    backup_id = make_runner(cluster).backup()['backupId']
+    path = os.path.join(backup_root, backup_id)
+    snapshot = open_snapshot(path)
+    items = { c: sorted(snapshot.ids(c)) for c in snapshot.config_types() }
+
+    rename = os.rename
+    renames = []
+
+    def interrupted_rename(src, dst):
+        if path in (src, dst):
+            renames.append(src)
+            if interrupted == len(renames):
+                raise KeyboardInterrupt
+        rename(src, dst)
+
+    with monkeypatch.context() as m:
+        m.setattr(os, 'rename', interrupted_rename)
+        with pytest.raises(KeyboardInterrupt):
+            Runner(backup_root).convert('archive')
+
+    Runner(backup_root).convert('archive')
+
+    snapshot = open_snapshot(path)
+    assert get_snapshot_format(path) == 'archive' and is_complete(path)
+    assert { c: sorted(snapshot.ids(c)) for c in snapshot.config_types() } == items
+    assert not os.listdir(os.path.join(backup_root, STAGING_DIR_NAME))
+
+    catalog = Catalog(backup_root)
+    assert [s['format'] for s in catalog.snapshots()] == ['archive']
+    assert len(catalog.items()) == sum(len(ids) for ids in items.values())
+    catalog.close()